@@ -0,0 +1,108 @@
+"""
+A module containing the cache of the aggregations computed by `PlotMaker`, shared by all the sessions of a process.
+
+The cache is bounded by the memory used by the aggregated dataframes, and evicts the least recently used ones first.
+The aggregations computed in the background by the prefetcher (see `prefetch.py`) are only kept if they fit without
+evicting the aggregations that were requested by a page.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+import os
+import threading
+import pandas as pd
+from rollups import rollup_key
+
+# The maximum memory used by the cached aggregations, in MB.
+AGGREGATION_CACHE_MB = int(os.environ.get('CRASH_DATA_CACHE_MB', 64))
+
+
+def cache_key(engine: str, measure: str, agg_func: str, grouping_cols: list[str], filters: dict) -> tuple:
+    """
+    Return the key identifying an aggregation in the cache.
+    """
+    return (engine, *rollup_key(measure, agg_func, grouping_cols, filters))
+
+
+class AggregationCache:
+    """
+    A thread-safe LRU cache of aggregated dataframes, bounded by their memory usage.
+
+    Attributes:
+        max_bytes: The maximum memory used by the cached dataframes.
+        size: The memory currently used by the cached dataframes.
+        hits: The number of lookups which found their aggregation.
+        misses: The number of lookups which did not.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits, self.misses = 0, 0
+        # The cached dataframes with their sizes, from the least to the most recently used.
+        self._entries = OrderedDict()
+        # The keys of the prefetched aggregations which have not been used yet.
+        self._prefetched = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: tuple) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: tuple) -> pd.DataFrame:
+        """
+        Return a copy of the cached aggregation, since some of the plots modify it, or `None` if it is not cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            self._prefetched.discard(key)
+            df, _ = self._entries[key]
+        return df.copy()
+
+    def _remove(self, key: tuple) -> None:
+        _, size = self._entries.pop(key)
+        self._prefetched.discard(key)
+        self.size -= size
+
+    def put(self, key: tuple, df: pd.DataFrame, prefetched: bool = False) -> None:
+        """
+        Cache a copy of an aggregation, evicting the least recently used ones if needed.
+
+        Arguments:
+            key: The key returned by `cache_key`.
+            df: The aggregated dataframe.
+            prefetched: Whether the aggregation was computed by the prefetcher. It then only evicts the other prefetched
+                aggregations, and is dropped if they do not free enough memory or if it is already cached.
+        """
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        df = df.copy()
+        with self._lock:
+            if key in self._entries:
+                if prefetched:
+                    return
+                self._remove(key)
+            while self.size + size > self.max_bytes:
+                if prefetched:
+                    victim = next((entry for entry in self._entries if entry in self._prefetched), None)
+                    if victim is None:
+                        return
+                else:
+                    victim = next(iter(self._entries))
+                self._remove(victim)
+            self._entries[key] = (df, size)
+            self.size += size
+            if prefetched:
+                self._prefetched.add(key)
+
+
+@lru_cache(maxsize=None)
+def get_aggregation_cache() -> AggregationCache:
+    """
+    Return the aggregation cache of the process.
+    """
+    return AggregationCache(max_bytes=AGGREGATION_CACHE_MB * 2**20)
@@ -0,0 +1,184 @@
+"""
+A small HTTP server which exposes the query API (see `query_api.py`) as JSON, so that many lightweight clients can be
+served by a single cached compute layer, without Streamlit:
+
+    GET /query?grouping=Year,Month&measure=Total_fatalities&agg_func=sum&filters={"Continent":["Europe"]}
+    GET /options?column=Country
+
+`grouping` is a comma-separated list of columns, `filters` a JSON object in which the year and decade ranges are
+lists of two values. A query returns `{"columns": [...], "data": [[...], ...]}`, an error `{"error": "..."}` with
+the status 400.
+
+The responses are cached, and carry an ETag. A request whose `If-None-Match` header matches it gets an empty 304
+response, so that the clients can keep their own copy.
+
+Run `python api_server.py [--host 127.0.0.1] [--port 8502]`.
+"""
+from collections import OrderedDict
+from datetime import date, datetime, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import hashlib
+import json
+import threading
+import numpy as np
+import pandas as pd
+from filters import filters_key, parse_filters
+from query_api import ENGINE, query, options
+
+# The maximum number of responses kept in the response cache.
+RESPONSE_CACHE_SIZE = 1024
+
+
+class ResponseCache:
+    """
+    A thread-safe LRU cache of response bodies, with their ETags.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> tuple[bytes, str]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: tuple, body: bytes) -> tuple[bytes, str]:
+        """
+        Cache a response body, and return it with its ETag.
+        """
+        entry = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def _json_value(value):
+    """
+    Convert the values which the `json` module cannot serialise.
+    """
+    if isinstance(value, (datetime, date, time, pd.Timestamp)):
+        return value.isoformat()
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    return str(value)
+
+
+def dataframe_payload(df: pd.DataFrame) -> dict:
+    """
+    Convert an aggregated dataframe into a JSON-serialisable dictionary, with the missing values as `null`.
+    """
+    values = df.astype(object).where(df.notna(), None)
+    return {'columns': [str(column) for column in df.columns], 'data': values.values.tolist()}
+
+
+def _single(parameters: dict, name: str, default: str = None) -> str:
+    values = parameters.get(name)
+    return values[-1] if values else default
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of the API. The response cache is shared by all the requests of the server.
+    """
+    response_cache = ResponseCache()
+    engine = ENGINE
+
+    def _parse_query(self, parameters: dict) -> tuple[tuple, dict]:
+        """
+        Return the cache key and the arguments of `query_api.query` of a query request.
+        """
+        grouping = _single(parameters, 'grouping')
+        if not grouping:
+            raise Exception('The `grouping` parameter is required.')
+        arguments = {
+            'grouping_cols': [column.strip() for column in grouping.split(',') if column.strip()],
+            'measure': _single(parameters, 'measure', 'Crashes'),
+            'agg_func': _single(parameters, 'agg_func'),
+            'filters': parse_filters(json.loads(_single(parameters, 'filters', '{}'))),
+            'engine': self.engine,
+        }
+        key = (
+            'query', arguments['engine'], arguments['measure'], arguments['agg_func'],
+            tuple(arguments['grouping_cols']), filters_key(arguments['filters'])
+        )
+        return key, arguments
+
+    def _respond(self, status: int, body: bytes = b'', etag: str = None) -> None:
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            # The clients may keep the response, but must check that it is still valid.
+            self.send_header('Cache-Control', 'no-cache')
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        parameters = parse_qs(url.query)
+        try:
+            if url.path == '/query':
+                key, arguments = self._parse_query(parameters)
+                compute = lambda: dataframe_payload(query(**arguments))
+            elif url.path == '/options':
+                column = _single(parameters, 'column')
+                if not column:
+                    raise Exception('The `column` parameter is required.')
+                key = ('options', self.engine, column)
+                compute = lambda: {'column': column, 'options': options(column, self.engine)}
+            else:
+                self._respond(404, json.dumps({'error': f'Unknown path {url.path}.'}).encode())
+                return
+
+            entry = self.response_cache.get(key)
+            if entry is None:
+                body = json.dumps(compute(), default=_json_value, allow_nan=False).encode()
+                entry = self.response_cache.put(key, body)
+        except Exception as error:
+            self._respond(400, json.dumps({'error': str(error)}).encode())
+            return
+
+        body, etag = entry
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self._respond(304, etag=etag)
+        else:
+            self._respond(200, body, etag=etag)
+
+
+def serve(host: str = '127.0.0.1', port: int = 8502, engine: str = ENGINE) -> None:
+    """
+    Serve the API until interrupted. The dataset is loaded before the first request.
+    """
+    QueryHandler.engine = engine
+    options('Year', engine)
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print(f'Serving the query API on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the aggregations of the dataset as JSON.')
+    parser.add_argument('--host', default='127.0.0.1', help='The address to listen on.')
+    parser.add_argument('--port', type=int, default=8502, help='The port to listen on.')
+    parser.add_argument('--engine', default=ENGINE, help='The engine that runs the aggregations, `pandas` or `duckdb`.')
+    args = parser.parse_args()
+    serve(host=args.host, port=args.port, engine=args.engine)
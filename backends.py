@@ -0,0 +1,275 @@
+"""
+A module containing the engines that the aggregations of `PlotMaker` can be run on.
+
+Every engine answers the same question: group the rows satisfying a filter dictionary (see `filters.py`) by some
+columns, and aggregate a measure. `Crashes` with no aggregation function counts the rows.
+
+    pandas: Loads the whole dataset in memory, and aggregates it using `groupby`.
+    duckdb: Runs the aggregation in an embedded DuckDB database directly over the Parquet file, so that the filters
+        are pushed down into the scan and only the aggregated result is materialised. With a partitioned dataset,
+        only the files of the partitions that can satisfy the filters are scanned.
+"""
+from abc import ABC, abstractmethod
+from functools import lru_cache
+import threading
+import pandas as pd
+import os
+from dataset_store import select_files
+from filters import FilterIndex, filters_key
+from utils import PROCESSED_DATASET, CATEGORY_ORDERS, load_dataset, find_crash_counts, aggregate_columns, partial_aggregate
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+def _quote(identifier: str) -> str:
+    """
+    Quote an identifier of a SQL query, doubling the quotes it contains so that it cannot end the quoted identifier.
+    """
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+class AggregationBackend(ABC):
+    """
+    The interface shared by all the aggregation engines.
+    """
+
+    @abstractmethod
+    def aggregate(self, grouping_cols: list[str], measure: str, agg_func: str, filters: dict) -> pd.DataFrame:
+        """
+        Aggregate `measure` by `agg_func` for each group of `grouping_cols`, on the rows satisfying `filters`.
+
+        Arguments:
+            grouping_cols: The names of the columns to group by. `Year` and `Day` are derived from the `Date` column.
+            measure: The numeric column to be aggregated, or `Crashes` to count the rows.
+            agg_func: The aggregation function to be applied, `None` to count the rows.
+            filters: The filter dictionary.
+
+        Returns:
+            A pandas DataFrame with a column for each grouping column, and a column named `measure`.
+        """
+
+    @abstractmethod
+    def aggregate_partials(self, grouping_cols: list[str], measure: str, filters: dict) -> pd.DataFrame:
+        """
+        Aggregate `measure` into the mergeable partial states of `utils.partial_aggregate`, for each group of
+        `grouping_cols`, on the rows satisfying `filters`.
+        """
+
+    @abstractmethod
+    def options(self, column: str) -> list:
+        """
+        Return the sorted list of values that `column` can be filtered by.
+        """
+
+
+class PandasBackend(AggregationBackend):
+    """
+    The default engine, which keeps the whole dataset in memory.
+
+    Attributes:
+        index: The filter index built over the dataset.
+    """
+
+    def __init__(self, path: str = PROCESSED_DATASET):
+        self.index = FilterIndex(load_dataset(path))
+        # The rows of the last filter dictionary of each thread, since every chart of a page is drawn with the same
+        # filters. The prefetching threads and the reruns of the other sessions do not replace them.
+        self._local = threading.local()
+
+    def _select(self, filters: dict) -> pd.DataFrame:
+        key = filters_key(filters)
+        last_key, last_rows = getattr(self._local, 'last_selection', (None, None))
+        if last_key == key:
+            return last_rows
+        rows = self.index.select(filters)
+        self._local.last_selection = (key, rows)
+        return rows
+
+    def aggregate(self, grouping_cols: list[str], measure: str, agg_func: str, filters: dict) -> pd.DataFrame:
+        df = self._select(filters)
+        if agg_func is None:
+            return find_crash_counts(df=df, grouping_cols=grouping_cols)
+        return aggregate_columns(df=df, column_names=grouping_cols, agg_func=agg_func, value_column=measure)
+
+    def aggregate_partials(self, grouping_cols: list[str], measure: str, filters: dict) -> pd.DataFrame:
+        return partial_aggregate(df=self._select(filters), grouping_cols=grouping_cols, value_column=measure)
+
+    def options(self, column: str) -> list:
+        return self.index.options(column)
+
+
+class DuckDBBackend(AggregationBackend):
+    """
+    An engine which aggregates the Parquet file in an embedded DuckDB database, without loading it in memory.
+
+    Attributes:
+        path: The path of the Parquet file or of the partitioned dataset.
+        connection: The in-memory DuckDB connection.
+    """
+    # SQL expressions for the columns which are not read as they are.
+    column_expressions = {
+        'Year': 'year("Date")',
+        'Day': 'day("Date")',
+        'Time': 'CAST("Time" AS TIME)',
+        'Continent': 'coalesce("Continent", \'Unknown\')',
+    }
+    agg_funcs_map = {
+        'sum': 'coalesce(sum({}), 0)',
+        'mean': 'avg({})',
+        'median': 'median({})',
+        'min': 'min({})',
+        'max': 'max({})',
+        'count': 'count({})',
+        'var': 'var_samp({})',
+        'std': 'stddev_samp({})',
+    }
+
+    def __init__(self, path: str = PROCESSED_DATASET):
+        if duckdb is None:
+            raise ImportError('The duckdb engine requires the `duckdb` package to be installed.')
+        self.path = path
+        self.connection = duckdb.connect()
+        self._lock = threading.Lock()
+
+    def _execute(self, query: str, parameters: list, fetch):
+        """
+        Run `query` and return the result of `fetch` on it, translating the errors of DuckDB into the errors of the
+        pandas engine. The connection is used by one query at a time.
+        """
+        try:
+            with self._lock:
+                return fetch(self.connection.execute(query, parameters))
+        except (duckdb.BinderException, duckdb.CatalogException):
+            raise Exception('The column name is invalid.')
+        except duckdb.ParserException:
+            raise Exception('The aggregation is invalid.')
+
+    def _expression(self, column: str) -> str:
+        # The rows of the Parquet file are identified by their position.
+        if column == 'Row_id' and not os.path.isdir(self.path):
+            return 'file_row_number'
+        return self.column_expressions.get(column, _quote(column))
+
+    def _source(self, filters: dict = None) -> tuple[str, list]:
+        """
+        Return the table function reading the dataset, and its parameters.
+
+        For a partitioned dataset, the decade partitions and files which cannot satisfy `filters` are not read.
+        """
+        if not os.path.isdir(self.path):
+            return 'read_parquet(?, file_row_number = true)', [self.path]
+        files = select_files(filters, self.path) or select_files(None, self.path)
+        return 'read_parquet(?, hive_partitioning = true)', [files]
+
+    def _value(self, measure: str) -> str:
+        """
+        Return the expression of a measure column. NaN is a missing value in pandas, so it is turned into NULL.
+        """
+        value = f'CAST({_quote(measure)} AS DOUBLE)'
+        return f'(CASE WHEN isnan({value}) THEN NULL ELSE {value} END)'
+
+    def _where_clause(self, filters: dict) -> tuple[str, list]:
+        """
+        Translate a filter dictionary into a SQL condition and its parameters.
+
+        The year range is written as a condition on the `Date` column itself, so that DuckDB can skip the row groups
+        of the Parquet file using their statistics.
+        """
+        conditions, parameters = ['TRUE'], []
+        for column, selection in (filters or {}).items():
+            if column == 'Year':
+                conditions.append('"Date" >= make_date(?, 1, 1) AND "Date" < make_date(?, 1, 1)')
+                parameters.extend([int(selection[0]), int(selection[1]) + 1])
+            elif column == 'Decade':
+                conditions.append('"Decade" BETWEEN ? AND ?')
+                parameters.extend([int(selection[0]), int(selection[1])])
+            elif len(selection) == 0:
+                conditions.append('FALSE')
+            else:
+                placeholders = ', '.join('?' for _ in selection)
+                conditions.append(f'{self._expression(column)} IN ({placeholders})')
+                parameters.extend(selection)
+        return ' AND '.join(conditions), parameters
+
+    def aggregate(self, grouping_cols: list[str], measure: str, agg_func: str, filters: dict) -> pd.DataFrame:
+        if agg_func is None:
+            measure_expression = 'count(*)'
+        else:
+            try:
+                measure_expression = self.agg_funcs_map[agg_func].format(self._value(measure))
+            except KeyError:
+                raise Exception('The aggregation function is not correct!')
+        return self._run_aggregation(grouping_cols, f'{measure_expression} AS {_quote(measure)}', filters)
+
+    def aggregate_partials(self, grouping_cols: list[str], measure: str, filters: dict) -> pd.DataFrame:
+        value = self._value(measure)
+        measure_expressions = ', '.join([
+            f'coalesce(sum({value}), 0) AS {_quote(measure + "_sum")}',
+            f'count({value}) AS {_quote(measure + "_count")}',
+            f'coalesce(sum({value} * {value}), 0) AS {_quote(measure + "_sumsq")}',
+            f'min({value}) AS {_quote(measure + "_min")}',
+            f'max({value}) AS {_quote(measure + "_max")}',
+        ])
+        return self._run_aggregation(grouping_cols, measure_expressions, filters)
+
+    def _run_aggregation(self, grouping_cols: list[str], measure_expressions: str, filters: dict) -> pd.DataFrame:
+        """
+        Run a grouped aggregation of `measure_expressions` over the Parquet file.
+        """
+        if not isinstance(grouping_cols, list):
+            grouping_cols = [grouping_cols]
+        group_expressions = [self._expression(column) for column in grouping_cols]
+        select_list = ', '.join(f'{expression} AS {_quote(column)}' for column, expression in zip(grouping_cols, group_expressions))
+        where_clause, parameters = self._where_clause(filters)
+        source, source_parameters = self._source(filters)
+        # Rows with a missing grouping value are dropped, like pandas does.
+        not_null = ' AND '.join(f'{expression} IS NOT NULL' for expression in group_expressions)
+        query = f"""
+            SELECT {select_list}, {measure_expressions}
+            FROM {source}
+            WHERE {where_clause} AND {not_null}
+            GROUP BY ALL
+        """
+        df_grouped = self._execute(query, [*source_parameters, *parameters], lambda result: result.df())
+
+        # Restore the calendar order of the categorical columns, and sort like pandas' groupby does.
+        for column in grouping_cols:
+            if column in CATEGORY_ORDERS:
+                df_grouped[column] = pd.Categorical(df_grouped[column], categories=CATEGORY_ORDERS[column], ordered=True)
+        return df_grouped.sort_values(by=grouping_cols, ignore_index=True)
+
+    def options(self, column: str) -> list:
+        expression = self._expression(column)
+        source, source_parameters = self._source()
+        values = self._execute(
+            f'SELECT DISTINCT {expression} FROM {source} WHERE {expression} IS NOT NULL', source_parameters, lambda result: result.fetchall()
+        )
+        values = [value for value, in values]
+        if column in CATEGORY_ORDERS:
+            return [value for value in CATEGORY_ORDERS[column] if value in values]
+        return sorted(values)
+
+
+ENGINES = {
+    'pandas': PandasBackend,
+    'duckdb': DuckDBBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_backend(engine: str = 'pandas', path: str = PROCESSED_DATASET) -> AggregationBackend:
+    """
+    Return the aggregation engine called `engine`. Each engine is created only once per process.
+
+    Arguments:
+        engine: One of `pandas` or `duckdb`.
+        path: The path of the processed dataset.
+    """
+    try:
+        backend_class = ENGINES[engine]
+    except KeyError:
+        raise Exception(f'The engine must be one of {list(ENGINES)}.')
+    return backend_class(path)
@@ -0,0 +1,371 @@
+"""
+A module which stores the processed dataset as a Parquet dataset partitioned by decade:
+
+    Processed_dataset/Crash_data/
+        _manifest.json
+        Decade=1990/part-00000.parquet
+        Decade=1990/part-00001.parquet
+        ...
+
+The manifest lists the files of each partition, with their number of rows and their first and last dates. Within a
+file, the rows are sorted by country, so that the statistics of its row groups can be used to skip them. Every row
+keeps the `Row_id` it was given when it was added to the dataset.
+
+New accidents are appended as new files in the partitions of their decades only. A filtered read skips the
+partitions, files and row groups which cannot satisfy the filters: the DuckDB engine reads the dataset this way for
+every aggregation, and `read_partitioned` accepts the same filters for scripts. The pandas engine does not prune
+anything, since it loads every row once to build its filter index.
+
+Run `python dataset_store.py` to convert the monolithic `Crash_data_new.parquet` written by the cleaning notebook
+into this layout. Once the dataset exists, the same command (which the notebook runs after saving) appends the crashes of
+the monolithic file that are not in the dataset yet, and the app warns when it has not been run since the file changed.
+
+Independently of the layout, the loaded dataset can be converted into an uncompressed Arrow IPC (Feather) file with
+`python dataset_store.py --arrow`. Every process then memory-maps that file instead of decoding the Parquet files, so
+that the pages of the dataset are shared between the processes instead of being copied into each of them.
+"""
+from datetime import datetime
+from functools import lru_cache
+import argparse
+import hashlib
+import json
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from filters import decade_years
+
+PARTITIONED_DATASET = 'Processed_dataset/Crash_data'
+MONOLITHIC_DATASET = 'Processed_dataset/Crash_data_new.parquet'
+ARROW_DATASET = 'Processed_dataset/Crash_data.arrow'
+MANIFEST_FILE = '_manifest.json'
+MANIFEST_VERSION = 1
+ROW_GROUP_SIZE = 256
+
+# The columns identifying a crash, which the cleaning notebook leaves as they were scraped.
+CRASH_KEY = ['Date', 'Operator', 'Registration']
+
+# The filters that are pushed down to the row groups, in addition to the years and decades.
+PUSHDOWN_FILTERS = ['Country', 'Continent', 'Operator', 'AC_Type', 'Type']
+
+
+def _read_manifest(root: str) -> dict:
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return {'version': MANIFEST_VERSION, 'next_row_id': 0, 'partitions': dict()}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+
+def _write_manifest(root: str, manifest: dict) -> None:
+    """
+    Replace the manifest atomically, so that readers never see a partially written one.
+    """
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    with open(f'{manifest_path}.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+def _write_partition_file(root: str, decade: int, df_partition: pd.DataFrame, part_number: int) -> dict:
+    """
+    Write the rows of one decade into a new file of its partition, and return its manifest entry.
+    """
+    relative_path = os.path.join(f'Decade={decade}', f'part-{part_number:05d}.parquet')
+    os.makedirs(os.path.join(root, f'Decade={decade}'), exist_ok=True)
+    df_partition = df_partition.drop(columns='Decade').sort_values(by=['Country', 'Date'], kind='stable')
+    table = pa.Table.from_pandas(df_partition, preserve_index=False)
+    pq.write_table(table, os.path.join(root, relative_path), row_group_size=ROW_GROUP_SIZE)
+    return {
+        'file': relative_path,
+        'rows': len(df_partition),
+        'min_date': df_partition['Date'].min().isoformat(),
+        'max_date': df_partition['Date'].max().isoformat(),
+    }
+
+
+def append_rows(df_new: pd.DataFrame, root: str = PARTITIONED_DATASET) -> list[str]:
+    """
+    Append processed rows to the dataset, by writing a new file in the partition of each affected decade.
+
+    Arguments:
+        df_new: The new rows, with the same columns as the processed dataset. If they have no `Row_id`, they are
+            numbered after the existing rows.
+        root: The root directory of the partitioned dataset.
+
+    Returns:
+        The list of files that were written.
+    """
+    manifest = _read_manifest(root)
+    if 'Row_id' not in df_new.columns:
+        df_new = df_new.assign(Row_id=np.arange(len(df_new), dtype=np.int64) + manifest['next_row_id'])
+    manifest['next_row_id'] = max(manifest['next_row_id'], int(df_new['Row_id'].max()) + 1)
+    written = []
+    for decade, df_partition in df_new.groupby('Decade'):
+        entries = manifest['partitions'].setdefault(str(decade), [])
+        entry = _write_partition_file(root, decade, df_partition, part_number=len(entries))
+        entries.append(entry)
+        written.append(entry['file'])
+    _write_manifest(root, manifest)
+    return written
+
+
+def write_partitioned(df: pd.DataFrame, root: str = PARTITIONED_DATASET) -> None:
+    """
+    Write the whole processed dataset into a new partitioned dataset at `root`.
+    """
+    if os.path.isfile(os.path.join(root, MANIFEST_FILE)):
+        raise Exception(f'{root} already contains a dataset. Use `append_rows` or `refresh_partitioned` to add rows to it.')
+    os.makedirs(root, exist_ok=True)
+    append_rows(df, root)
+
+
+def _crash_keys(df: pd.DataFrame) -> pd.Series:
+    """
+    Identify the crashes of `df` by the columns of `CRASH_KEY`, numbering the crashes which share them.
+    """
+    keys = df[CRASH_KEY].astype(str).agg('|'.join, axis=1)
+    return keys + '#' + keys.groupby(keys).cumcount().astype(str)
+
+
+def _row_hashes(df: pd.DataFrame) -> pd.Series:
+    """
+    Hash the values of each row of `df`, with every kind of missing value hashed alike.
+    """
+    values = df.astype(object).where(df.notna(), None).astype(str)
+    return pd.util.hash_pandas_object(values, index=False)
+
+
+def refresh_partitioned(source: str = MONOLITHIC_DATASET, root: str = PARTITIONED_DATASET) -> list[str]:
+    """
+    Append the crashes of the monolithic file written by the cleaning notebook which are not in the partitioned
+    dataset yet, creating the dataset if needed.
+
+    The notebook rewrites the whole file, in which the existing rows move, so the crashes are identified by their
+    `CRASH_KEY`. The dataset is append-only: the crashes removed from the monolithic file are kept, and an Exception
+    is raised if the values of an existing crash changed, in which case the dataset must be rebuilt.
+
+    Arguments:
+        source: The path of the monolithic Parquet file.
+        root: The root directory of the partitioned dataset.
+
+    Returns:
+        The list of files that were written.
+    """
+    df_source = pd.read_parquet(source)
+    if not os.path.isfile(os.path.join(root, MANIFEST_FILE)):
+        os.makedirs(root, exist_ok=True)
+        written = append_rows(df_source, root)
+    else:
+        df_stored = read_partitioned(root, columns=list(df_source.columns))
+        source_keys, stored_keys = _crash_keys(df_source), _crash_keys(df_stored)
+        existing = source_keys.isin(stored_keys).to_numpy()
+        source_hashes = _row_hashes(df_source[existing]).set_axis(source_keys[existing])
+        stored_hashes = _row_hashes(df_stored).set_axis(stored_keys)
+        changed = source_hashes.index[source_hashes != stored_hashes.loc[source_hashes.index]].tolist()
+        if changed:
+            raise Exception(
+                f'{len(changed)} crashes of {source} were changed since they were added to {root}, for example '
+                f'{", ".join(changed[:3])}. The partitioned dataset is append-only: remove it and run '
+                '`python dataset_store.py` to rebuild it.'
+            )
+        written = append_rows(df_source[~existing], root) if not existing.all() else []
+    # The manifest records the file it is up to date with, see `partitioned_is_stale`.
+    manifest = _read_manifest(root)
+    source_fingerprint = dataset_fingerprint(source)
+    if manifest.get('source_sha256') != source_fingerprint:
+        manifest['source_sha256'] = source_fingerprint
+        _write_manifest(root, manifest)
+    return written
+
+
+def partitioned_is_stale(source: str = MONOLITHIC_DATASET, root: str = PARTITIONED_DATASET) -> bool:
+    """
+    Whether the monolithic file has changed since the partitioned dataset was last refreshed from it.
+    """
+    if not os.path.isfile(source):
+        return False
+    return _read_manifest(root).get('source_sha256') != dataset_fingerprint(source)
+
+
+def _year_bounds(filters: dict) -> tuple[int, int]:
+    """
+    Reduce the year and decade ranges of `filters` to a single inclusive year range.
+    """
+    first_year, last_year = None, None
+    for column in ['Year', 'Decade']:
+        if column in filters:
+            start, end = decade_years(*filters[column]) if column == 'Decade' else filters[column]
+            first_year = start if first_year is None else max(first_year, start)
+            last_year = end if last_year is None else min(last_year, end)
+    return first_year, last_year
+
+
+def select_files(filters: dict = None, root: str = PARTITIONED_DATASET) -> list[str]:
+    """
+    Return the files of the dataset which may contain rows satisfying the year and decade ranges of `filters`.
+
+    Whole partitions are skipped by their decade, and the remaining files by their first and last dates.
+    """
+    first_year, last_year = _year_bounds(filters or dict())
+    files = []
+    for decade, entries in _read_manifest(root)['partitions'].items():
+        decade = int(decade)
+        if first_year is not None and decade + 9 < first_year or last_year is not None and decade > last_year:
+            continue
+        for entry in entries:
+            if first_year is not None and int(entry['max_date'][:4]) < first_year:
+                continue
+            if last_year is not None and int(entry['min_date'][:4]) > last_year:
+                continue
+            files.append(os.path.join(root, entry['file']))
+    return files
+
+
+def _filter_expression(filters: dict):
+    """
+    Translate the filters into a pyarrow expression, which is evaluated against the statistics of the row groups.
+    """
+    expression = None
+    conditions = []
+    first_year, last_year = _year_bounds(filters)
+    if first_year is not None:
+        conditions.append(ds.field('Date') >= pa.scalar(datetime(first_year, 1, 1), type=pa.timestamp('us')))
+    if last_year is not None:
+        conditions.append(ds.field('Date') < pa.scalar(datetime(last_year + 1, 1, 1), type=pa.timestamp('us')))
+    for column in PUSHDOWN_FILTERS:
+        if column in filters:
+            condition = ds.field(column).isin(list(filters[column]))
+            # The missing continents are only replaced by `Unknown` once loaded, see `utils.load_dataset`.
+            if column == 'Continent' and 'Unknown' in filters[column]:
+                condition = condition | ds.field(column).is_null()
+            conditions.append(condition)
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_partitioned(
+        root: str = PARTITIONED_DATASET,
+        filters: dict = None,
+        columns: list[str] = None,
+        files: list[str] = None
+    ) -> pd.DataFrame:
+    """
+    Read the rows of the partitioned dataset, reading only the partitions, files and row groups that may satisfy
+    `filters`. The remaining filters (months, days, etc.) are left to `FilterIndex`.
+
+    Arguments:
+        root: The root directory of the partitioned dataset.
+        filters: The filter dictionary.
+        columns: The columns to read. By default, all of them.
+        files: The files to read, as returned by `select_files`. By default, those which may satisfy `filters`.
+
+    Returns:
+        A pandas DataFrame containing the rows read, sorted by date in descending order like the monolithic file.
+    """
+    filters = filters or dict()
+    if files is None:
+        # When no file can satisfy the filters, one file is still read for the schema, and the filter removes its rows.
+        files = select_files(filters, root) or select_files(None, root)[:1]
+    dataset = ds.dataset(files, format='parquet', partitioning='hive', partition_base_dir=root)
+    table = dataset.to_table(columns=columns, filter=_filter_expression(filters))
+    df = table.to_pandas()
+    if 'Decade' in df.columns:
+        df['Decade'] = df['Decade'].astype('int64')
+    return df.sort_values(by='Date', ascending=False, kind='stable', ignore_index=True)
+
+
+def dataset_fingerprint(path: str) -> str:
+    """
+    Return a hash of the dataset at `path`, which is either a Parquet file or a partitioned dataset. Since the files
+    of a partitioned dataset are never rewritten, the hash of its manifest is used.
+
+    The hash is only recomputed when the file is modified or replaced, so that it can be checked on every query.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_FILE)
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+@lru_cache(maxsize=64)
+def _file_digest(path: str, mtime_ns: int, size: int, inode: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_arrow(df: pd.DataFrame, source_fingerprint: str, path: str = ARROW_DATASET) -> None:
+    """
+    Write the loaded dataset into an uncompressed Arrow IPC file, which can be memory-mapped.
+
+    The file is replaced atomically, so that the processes which have mapped the previous file keep reading it.
+
+    Arguments:
+        df: The loaded dataset.
+        source_fingerprint: The `dataset_fingerprint` of the dataset `df` was loaded from.
+        path: The path of the Arrow file.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'source_sha256': source_fingerprint.encode()})
+    feather.write_feather(table, f'{path}.tmp', compression='uncompressed')
+    os.replace(f'{path}.tmp', path)
+
+
+def _arrow_dtype(arrow_type: pa.DataType):
+    """
+    Wrap the Arrow columns in pandas without copying them. The dictionary-encoded columns become pandas categoricals,
+    whose codes are small.
+    """
+    if pa.types.is_dictionary(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+
+def read_arrow(source_fingerprint: str, path: str = ARROW_DATASET) -> pd.DataFrame:
+    """
+    Memory-map the Arrow file written by `write_arrow`.
+
+    With pandas 2.0 or later (see `requirements.txt`), the columns of the returned DataFrame are views over the mapped
+    file, which the operating system shares between all the processes reading it. Older versions of pandas cannot wrap
+    Arrow arrays: the columns are then copied with a warning, and only the Parquet decoding is skipped.
+
+    Arguments:
+        source_fingerprint: The `dataset_fingerprint` of the dataset the file must have been written from.
+        path: The path of the Arrow file.
+
+    Returns:
+        A pandas DataFrame, or `None` if the file is missing or was written from another dataset.
+    """
+    if not os.path.isfile(path):
+        return None
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        if (reader.schema.metadata or dict()).get(b'source_sha256') != source_fingerprint.encode():
+            return None
+        table = reader.read_all()
+    if not hasattr(pd, 'ArrowDtype'):
+        warnings.warn(
+            f'pandas {pd.__version__} cannot wrap Arrow arrays, so the memory-mapped dataset is copied into every '
+            'process. Install pandas 2.0 or later to share it.'
+        )
+        return table.to_pandas()
+    return table.to_pandas(types_mapper=_arrow_dtype)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the processed dataset.')
+    parser.add_argument('--arrow', action='store_true', help='Convert the processed dataset into a memory-mappable Arrow file instead.')
+    args = parser.parse_args()
+    if args.arrow:
+        from utils import build_arrow_dataset
+        build_arrow_dataset()
+    else:
+        refresh_partitioned()
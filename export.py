@@ -0,0 +1,159 @@
+"""
+A module which exports the charts of the pages into static bundles, which can be served from a plain file server
+without running the app:
+
+    export/
+        index.html
+        plotly.min.js
+        Crashes/all/index.html
+        Crashes/all/year.json
+        ...
+
+Every page is exported for each filter combination of the configuration file (`export_config.json` by default).
+Each bundle contains an HTML page showing the same charts as the live page with those filters, and the JSON of every
+figure. The bundles are rendered in parallel, by a pool of processes.
+
+Run `python export.py [--config export_config.json] [--output export] [--workers N]`.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import html
+import json
+import os
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+from filters import parse_filters
+from page_spec import PAGES, DATE_HISTOGRAMS, HEATMAPS, page_charts
+from plot_creator import PlotMaker
+from query_api import ENGINE
+
+EXPORT_CONFIG = 'export_config.json'
+EXPORT_DIRECTORY = 'export'
+
+
+def read_config(path: str = EXPORT_CONFIG) -> dict:
+    """
+    Read the export configuration, and convert its filter combinations into filter dictionaries.
+    """
+    with open(path, 'r') as file:
+        config = json.load(file)
+    for combination in config['filter_combinations']:
+        combination['filters'] = parse_filters(combination['filters'])
+    return config
+
+
+def chart_drawers(plotter: PlotMaker, filters: dict, target_type: str, treemap_flag: bool, height: int) -> list:
+    """
+    List the charts of a page for the given filters, as drawn by `Template.make_page` (see `page_spec.page_charts`).
+
+    Returns:
+        A list of (chart name, function drawing the chart) pairs.
+    """
+    heatmap_kwargs = dict(target_type=target_type, height=height, show_value=False)
+    treemap_kwargs = dict(height=height, us_exclude_flag=False, threshold=1, top_k=25, min_share=0.001)
+    drawers = {
+        'year': lambda: plotter.draw_line_plot(grouping_col='Year', title='Per year', height=height),
+        'time': lambda: plotter.draw_time_histogram(nbins=24*2, title='Time of day', height=height),
+        'world-map': lambda: plotter.draw_world_map(us_exclude_flag=False, grouping_col='Country', title='Crashes throughout the world'),
+        'us-map': lambda: plotter.draw_US_map(title='Crashes throughout the US'),
+        'heatmap-year-month': lambda: plotter.draw_heatmap_year_month(title=HEATMAPS['heatmap-year-month'], **heatmap_kwargs),
+        'heatmap-month-day': lambda: plotter.draw_heatmap_month_day(title=HEATMAPS['heatmap-month-day'], **heatmap_kwargs),
+        'heatmap-month-day-number': lambda: plotter.draw_heatmap_month_day_number(title=HEATMAPS['heatmap-month-day-number'], **heatmap_kwargs),
+        'treemap-country': lambda: plotter.draw_country_treemap(**treemap_kwargs),
+        'treemap-continent-country': lambda: plotter.draw_continent_country_treemap(**treemap_kwargs),
+    }
+    for chart, (column, title) in DATE_HISTOGRAMS.items():
+        drawers[chart] = lambda column=column, title=title: plotter.draw_histogram(grouping_col=column, title=title, height=height)
+    return [(chart, drawers[chart]) for chart in page_charts(filters, treemap_flag)]
+
+
+def export_bundle(page_name: str, combination: dict, config: dict, output: str, engine: str = ENGINE) -> tuple[str, int]:
+    """
+    Render every chart of a page for one filter combination, and write them into a bundle.
+
+    Arguments:
+        page_name: The name of the page, one of `PAGES`.
+        combination: The filter combination, with its `name` and its `filters`.
+        config: The export configuration.
+        output: The root directory of the export.
+        engine: The engine that runs the aggregations.
+
+    Returns:
+        The directory of the bundle, and the number of figures written.
+    """
+    page = PAGES[page_name]
+    figures = []
+    plotter = PlotMaker(
+        measure=page['measure'],
+        agg_func=page['agg_func'],
+        continuous_colour=config['continuous_colour'],
+        discrete_colour=config['discrete_colour'],
+        engine=engine
+    )
+    plotter.filters = combination['filters']
+
+    bundle_directory = os.path.join(output, page_name, combination['name'])
+    os.makedirs(bundle_directory, exist_ok=True)
+    charts = chart_drawers(plotter, combination['filters'], page['target_type'], page['treemap_flag'], config['height'])
+    for chart_name, draw in charts:
+        chart_figures = []
+        plotter.figure_sink = chart_figures.append
+        draw()
+        # Some charts, such as the year and month heatmaps, are made of several figures.
+        for i, fig in enumerate(chart_figures):
+            figure_name = chart_name if len(chart_figures) == 1 else f'{chart_name}-{i + 1}'
+            with open(os.path.join(bundle_directory, f'{figure_name}.json'), 'w') as file:
+                file.write(fig.to_json())
+            figures.append((figure_name, fig))
+
+    divs = '\n'.join(
+        f'<div id="{name}">{pio.to_html(fig, include_plotlyjs=False, full_html=False)}</div>' for name, fig in figures
+    )
+    page_title = html.escape(f"{page['title']} ({combination['name']})")
+    with open(os.path.join(bundle_directory, 'index.html'), 'w') as file:
+        file.write(
+            f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{page_title}</title>\n'
+            f'<script src="../../plotly.min.js"></script>\n</head>\n<body>\n<h1>{page_title}</h1>\n{divs}\n</body>\n</html>\n'
+        )
+    return bundle_directory, len(figures)
+
+
+def export_all(config_path: str = EXPORT_CONFIG, output: str = EXPORT_DIRECTORY, workers: int = None, engine: str = ENGINE) -> None:
+    """
+    Export every page for every filter combination of the configuration, using a pool of `workers` processes.
+    """
+    config = read_config(config_path)
+    os.makedirs(output, exist_ok=True)
+    # The bundles share a single copy of plotly.js, so that they work without an internet connection.
+    with open(os.path.join(output, 'plotly.min.js'), 'w') as file:
+        file.write(get_plotlyjs())
+
+    tasks = [(page_name, combination) for page_name in PAGES for combination in config['filter_combinations']]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(export_bundle, page_name, combination, config, output, engine)
+            for page_name, combination in tasks
+        ]
+        for future in futures:
+            bundle_directory, figure_count = future.result()
+            print(f'{bundle_directory}: {figure_count} figures')
+
+    links = '\n'.join(
+        f'<li><a href="{page_name}/{combination["name"]}/index.html">'
+        f'{html.escape(PAGES[page_name]["title"])} ({html.escape(combination["name"])})</a></li>'
+        for page_name, combination in tasks
+    )
+    with open(os.path.join(output, 'index.html'), 'w') as file:
+        file.write(
+            '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>Plane crash dataset visualisation</title>\n'
+            f'</head>\n<body>\n<h1>Plane crash dataset visualisation</h1>\n<ul>\n{links}\n</ul>\n</body>\n</html>\n'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the charts of every page into static HTML/JSON bundles.')
+    parser.add_argument('--config', default=EXPORT_CONFIG, help='The configuration file listing the filter combinations.')
+    parser.add_argument('--output', default=EXPORT_DIRECTORY, help='The directory to write the bundles to.')
+    parser.add_argument('--workers', type=int, default=None, help='The number of processes. By default, one per CPU.')
+    args = parser.parse_args()
+    export_all(config_path=args.config, output=args.output, workers=args.workers)
@@ -0,0 +1,205 @@
+"""
+A module containing a date-sorted index over the processed dataset, used to apply the page filters.
+
+Filters are passed around as plain dictionaries which map a filter name to its selection:
+
+    {
+        'Year': (1990, 2005),                          # inclusive range
+        'Decade': (1950, 1980),                        # inclusive range
+        'Country': ['Nepal', 'India'],                 # any of the values
+        'Month': ['January'],
+        'Day': [1, 15],                                # day number of the month
+        'Row_id': [12, 873],                           # the rows returned by the search index
+    }
+
+A missing key means that no filter is applied on that column.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Filters which are applied as inclusive ranges.
+RANGE_FILTERS = ['Year', 'Decade']
+
+# Filters which are applied as "any of the values", by comparing categorical codes.
+CATEGORICAL_FILTERS = ['Country', 'Continent', 'Operator', 'AC_Type', 'Type', 'Month', 'Day_of_week', 'Day']
+
+
+def filters_key(filters: dict) -> tuple:
+    """
+    Convert a filter dictionary into a hashable key, so that results computed for it can be cached.
+
+    Arguments:
+        filters: The filter dictionary.
+
+    Returns:
+        A tuple of (filter name, selection) pairs, sorted by the filter name.
+    """
+    if not filters:
+        return ()
+    return tuple(sorted((name, tuple(values)) for name, values in filters.items()))
+
+
+def parse_filters(spec: dict) -> dict:
+    """
+    Convert filters read from JSON, in which the ranges are lists, into a filter dictionary.
+
+    Arguments:
+        spec: A dictionary mapping filter names to their selections.
+
+    Returns:
+        The filter dictionary.
+    """
+    filters = dict()
+    for column, selection in (spec or dict()).items():
+        if column in RANGE_FILTERS:
+            if len(selection) != 2:
+                raise Exception(f'The `{column}` filter must be a range of two values.')
+            filters[column] = (int(selection[0]), int(selection[1]))
+        elif column in CATEGORICAL_FILTERS or column == 'Row_id':
+            filters[column] = list(selection)
+        else:
+            raise Exception(f'The dataset cannot be filtered by `{column}`.')
+    return filters
+
+
+def decade_years(start: int, end: int) -> tuple[int, int]:
+    """
+    Convert an inclusive decade range into the inclusive year range of the decades it contains. The bounds which are
+    not multiples of ten are rounded inward, like the `Decade` column is compared with them.
+    """
+    return -(-start // 10) * 10, end // 10 * 10 + 9
+
+
+def single_value(filters: dict, column: str) -> bool:
+    """
+    Whether only one value of `column` is selected, in which case the pages do not show its chart.
+    """
+    if column not in filters:
+        return False
+    if column in RANGE_FILTERS:
+        return filters[column][0] == filters[column][1]
+    return len(filters[column]) == 1
+
+
+def narrow_filters(filters: dict, column: str, values: list) -> dict:
+    """
+    Return a copy of `filters` which further restricts `column` to `values`.
+
+    If `column` is already filtered, the intersection of both selections is kept.
+
+    Arguments:
+        filters: The filter dictionary.
+        column: The name of the categorical filter.
+        values: The values to restrict the column to.
+    """
+    narrowed = dict(filters)
+    existing = narrowed.get(column)
+    if existing is None:
+        narrowed[column] = list(values)
+    else:
+        narrowed[column] = [value for value in existing if value in values]
+    return narrowed
+
+
+class FilterIndex:
+    """
+    A date-sorted view of the dataset which answers filter queries without scanning the whole dataframe.
+
+    Year and decade ranges are turned into a positional slice by binary searching the sorted dates, so that
+    they cost O(log n). The categorical filters are then applied only to that slice, by comparing the integer
+    codes of each column with the codes of the selected values.
+
+    Attributes:
+        df: The dataset, sorted by date in ascending order.
+        dates: The sorted dates as a numpy array.
+        row_ids: The `Row_id` of each row, as a numpy array.
+        codes: A dictionary with the column name as the key, and its categorical codes as the value.
+        categories: A dictionary with the column name as the key, and the categories of its codes as the value.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        """
+        Arguments:
+            df: The processed dataset.
+        """
+        # The dataset may already be sorted, for example when it is memory-mapped, in which case it is not copied.
+        if not df['Date'].is_monotonic_increasing:
+            df = df.sort_values(by='Date', kind='stable')
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+            df = df.reset_index(drop=True)
+        self.df = df
+        self.dates = self.df['Date'].to_numpy()
+        self.row_ids = self.df['Row_id'].to_numpy() if 'Row_id' in self.df.columns else None
+        self.codes, self.categories = dict(), dict()
+        for column in CATEGORICAL_FILTERS:
+            values = self.df['Date'].dt.day if column == 'Day' else self.df[column]
+            categorical = pd.Categorical(values)
+            self.codes[column] = categorical.codes
+            self.categories[column] = categorical.categories
+
+    def options(self, column: str) -> list:
+        """
+        Return the sorted list of values that `column` can be filtered by.
+        """
+        if column == 'Year':
+            return sorted(self.df['Date'].dt.year.unique().tolist())
+        if column == 'Decade':
+            return sorted(self.df['Decade'].unique().tolist())
+        return self.categories[column].tolist()
+
+    def _year_position(self, year: int) -> int:
+        """
+        Find the position of the first row on or after the 1st of January of `year`, using binary search.
+        """
+        start = np.datetime64(f'{int(year):04d}-01-01').astype(self.dates.dtype)
+        return int(np.searchsorted(self.dates, start, side='left'))
+
+    def date_slice(self, filters: dict) -> slice:
+        """
+        Find the positional slice of the rows that satisfy the year and decade ranges in `filters`.
+
+        Since decades are aligned to years, both ranges are reduced to a single year range.
+        """
+        first_year, last_year = -np.inf, np.inf
+        if 'Year' in filters:
+            start, end = filters['Year']
+            first_year, last_year = max(first_year, start), min(last_year, end)
+        if 'Decade' in filters:
+            start, end = decade_years(*filters['Decade'])
+            first_year, last_year = max(first_year, start), min(last_year, end)
+
+        lower, upper = 0, len(self.dates)
+        if first_year != -np.inf:
+            lower = self._year_position(first_year)
+        if last_year != np.inf:
+            upper = self._year_position(last_year + 1)
+        return slice(lower, max(lower, upper))
+
+    def select(self, filters: dict) -> pd.DataFrame:
+        """
+        Return the rows of the dataset which satisfy all of `filters`.
+
+        Arguments:
+            filters: The filter dictionary.
+
+        Returns:
+            A pandas DataFrame containing the filtered rows, in date order.
+        """
+        if not filters:
+            return self.df
+        rows = self.date_slice(filters)
+        mask = None
+        for column in CATEGORICAL_FILTERS:
+            if column not in filters:
+                continue
+            selected_codes = self.categories[column].get_indexer(list(filters[column]))
+            column_mask = np.isin(self.codes[column][rows], selected_codes[selected_codes >= 0])
+            mask = column_mask if mask is None else mask & column_mask
+        if 'Row_id' in filters:
+            column_mask = np.isin(self.row_ids[rows], np.asarray(filters['Row_id']))
+            mask = column_mask if mask is None else mask & column_mask
+        df_slice = self.df.iloc[rows]
+        if mask is None:
+            return df_slice
+        return df_slice[mask]
@@ -0,0 +1,413 @@
+"""
+A load-test harness which runs the app locally, and drives concurrent simulated sessions over the websocket protocol
+of Streamlit, the same way browsers do.
+
+Each session opens one of the crash, fatality and survival rate pages by its name, as a browser opening its URL does,
+and then keeps switching between them, toggling filters, moving the year and decade sliders to random ranges, picking
+random values in the multiselect filters, and changing the heatmap and treemap options, waiting for every rerun to
+finish. The random selections make most of the filtered reruns miss the aggregation cache, as they do with real users. The latency of a rerun is the time between the message asking for it and the end
+of the script run.
+
+While the sessions run, the CPU time and the resident memory of the server processes (and of this harness) are read
+from `/proc`, so that it runs offline on a single Linux machine.
+
+Run `python load_test.py --sessions 20 --duration 60`. The environment variables of the app (`CRASH_DATA_ENGINE`,
+`CRASH_DATA_PREFETCH`, etc.) are passed to the servers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.Common_pb2 import DoubleArray, Int32Array, StringArray
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.MultiSelect_pb2 import MultiSelect
+from streamlit.proto.NumberInput_pb2 import NumberInput
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from page_spec import PAGES
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# The pages that the sessions switch between.
+LOAD_TEST_PAGES = list(PAGES)
+
+# The labels of the checkboxes that the sessions toggle.
+FILTER_CHECKBOXES = [
+    'Country/Region', 'Continent', 'Operator', 'Aircraft type', 'Year', 'Month', 'Day of week', 'Day', 'Decade',
+    'Commercial flights',
+]
+OPTION_CHECKBOXES = ['Show values?', 'Ignore the US?', 'Exclude the US from world map?']
+
+# The number inputs of the treemaps, identified by the beginning of their labels, with the range of their values.
+NUMBER_INPUTS = {
+    'Enter the threshold value': (1, 50),
+    'Enter the maximum number of countries': (5, 40),
+}
+
+# The maximum number of values picked in a multiselect filter.
+MAX_SELECTED_VALUES = 3
+
+# The probability of each action of a session, once a page has been opened.
+ACTIONS = {
+    'switch_page': 0.15,
+    'toggle_filter': 0.25,
+    'change_range': 0.2,
+    'change_selection': 0.2,
+    'toggle_option': 0.1,
+    'change_number': 0.1,
+}
+
+# Newer versions of Streamlit identify the selected options of a multiselect by their labels, older ones by their indices.
+MULTISELECT_LABELS = 'raw_values' in MultiSelect.DESCRIPTOR.fields_by_name
+
+
+class SimulatedSession:
+    """
+    A browser session, which reruns the pages of the app over a websocket.
+
+    Attributes:
+        url: The websocket URL of the server.
+        latencies: The (page, action, seconds) tuple of every rerun.
+        errors: The number of reruns which raised an exception or did not finish.
+    """
+
+    def __init__(self, url: str, seed: int, think_time: float, timeout: float):
+        self.url = url
+        self.random = random.Random(seed)
+        self.think_time = think_time
+        self.timeout = timeout
+        self.latencies = []
+        self.errors = 0
+        # The script hash of each page, learnt from the first message of the server.
+        self.page_hashes = dict()
+        self.page = self.random.choice(LOAD_TEST_PAGES)
+        # The widgets of the current page, as {label: (widget type, widget element)}, learnt from the deltas of its
+        # last rerun.
+        self.widgets = dict()
+        self.widget_states = dict()
+
+    def _learn_pages(self, app_pages) -> None:
+        # Some versions of Streamlit replace the underscores of the file names by spaces.
+        for app_page in app_pages:
+            self.page_hashes[app_page.page_name.replace(' ', '_')] = app_page.page_script_hash
+
+    def _learn_widget(self, message: ForwardMsg, widgets: dict) -> bool:
+        """
+        Record the widget created by a delta into `widgets`. Returns whether the delta is an exception.
+        """
+        if message.delta.WhichOneof('type') != 'new_element':
+            return False
+        element = message.delta.new_element
+        element_type = element.WhichOneof('type')
+        if element_type == 'exception':
+            return True
+        if element_type in ['checkbox', 'number_input', 'slider', 'multiselect']:
+            widget = getattr(element, element_type)
+            widgets[widget.label] = (element_type, widget)
+        return False
+
+    async def _rerun(self, websocket, action: str) -> None:
+        """
+        Ask for a rerun of the current page with the current widget states, and wait until it has finished.
+        """
+        message = BackMsg()
+        message.rerun_script.query_string = ''
+        # Until the script hashes of the pages are known, the page is found by its name.
+        message.rerun_script.page_script_hash = self.page_hashes.get(self.page, '')
+        message.rerun_script.page_name = self.page
+        message.rerun_script.widget_states.widgets.extend(self.widget_states.values())
+
+        start = time.perf_counter()
+        await websocket.send(message.SerializeToString())
+        failed = False
+        # Only the widgets drawn by this rerun can be changed by the next action.
+        widgets = dict()
+        while True:
+            response = ForwardMsg()
+            response.ParseFromString(await asyncio.wait_for(websocket.recv(), timeout=self.timeout))
+            response_type = response.WhichOneof('type')
+            # Older versions of Streamlit list the pages in the new session message, newer ones in a navigation one.
+            if response_type == 'new_session':
+                self._learn_pages(response.new_session.app_pages)
+            elif response_type == 'navigation':
+                self._learn_pages(response.navigation.app_pages)
+            elif response_type == 'delta':
+                failed = self._learn_widget(response, widgets) or failed
+            elif response_type == 'script_finished':
+                failed = failed or response.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR
+                break
+        self.widgets = widgets
+        self.latencies.append((self.page, action, time.perf_counter() - start))
+        self.errors += failed
+
+    def _find_widget(self, labels: list[str] = None, widget_type: str = None) -> tuple:
+        """
+        Return the label, the type and the element of a random widget of the current page whose label starts with one
+        of `labels`, or whose type is `widget_type`, or `None` if there is none.
+        """
+        candidates = [
+            label for label, (element_type, _) in self.widgets.items()
+            if element_type == widget_type or labels is not None and any(label.startswith(prefix) for prefix in labels)
+        ]
+        if not candidates:
+            return None
+        label = self.random.choice(sorted(candidates))
+        return (label, *self.widgets[label])
+
+    def _next_action(self) -> str:
+        """
+        Pick the next action, and change the page or the widget states accordingly.
+        """
+        action = self.random.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        if action == 'toggle_filter' or action == 'toggle_option':
+            widget = self._find_widget(FILTER_CHECKBOXES if action == 'toggle_filter' else OPTION_CHECKBOXES)
+            if widget is not None:
+                _, _, checkbox = widget
+                current = self.widget_states.get(checkbox.id)
+                value = checkbox.default if current is None else current.bool_value
+                self.widget_states[checkbox.id] = WidgetState(id=checkbox.id, bool_value=not value)
+                return action
+        elif action == 'change_number':
+            widget = self._find_widget(list(NUMBER_INPUTS))
+            if widget is not None:
+                label, _, number_input = widget
+                low, high = next(bounds for prefix, bounds in NUMBER_INPUTS.items() if label.startswith(prefix))
+                value = self.random.randint(low, high)
+                if number_input.data_type == NumberInput.INT:
+                    self.widget_states[number_input.id] = WidgetState(id=number_input.id, int_value=value)
+                else:
+                    self.widget_states[number_input.id] = WidgetState(id=number_input.id, double_value=value)
+                return action
+        elif action == 'change_range':
+            # The sliders of the filters select a range, unlike the one of the figure heights.
+            sliders = [
+                widget for label, (widget_type, widget) in sorted(self.widgets.items())
+                if widget_type == 'slider' and len(widget.default) == 2
+            ]
+            if sliders:
+                slider = self.random.choice(sliders)
+                # The bounds of the range are picked among the steps of the slider.
+                steps = int(round((slider.max - slider.min) / slider.step))
+                low, high = sorted(self.random.randint(0, steps) for _ in range(2))
+                values = [slider.min + low * slider.step, slider.min + high * slider.step]
+                self.widget_states[slider.id] = WidgetState(id=slider.id, double_array_value=DoubleArray(data=values))
+                return action
+        elif action == 'change_selection':
+            widget = self._find_widget(widget_type='multiselect')
+            if widget is not None and len(widget[2].options) > 0:
+                _, _, multiselect = widget
+                count = self.random.randint(1, min(MAX_SELECTED_VALUES, len(multiselect.options)))
+                indices = sorted(self.random.sample(range(len(multiselect.options)), count))
+                if MULTISELECT_LABELS:
+                    values = StringArray(data=[multiselect.options[i] for i in indices])
+                    self.widget_states[multiselect.id] = WidgetState(id=multiselect.id, string_array_value=values)
+                else:
+                    self.widget_states[multiselect.id] = WidgetState(id=multiselect.id, int_array_value=Int32Array(data=indices))
+                return action
+        # Switching page, or the page has no such widget: the widgets of the new page start from their defaults.
+        self.page = self.random.choice([page for page in LOAD_TEST_PAGES if page != self.page])
+        self.widgets, self.widget_states = dict(), dict()
+        return 'switch_page'
+
+    async def run(self, deadline: float) -> None:
+        """
+        Run the session until `deadline`, on the `time.perf_counter` clock.
+        """
+        try:
+            async with websockets.connect(self.url, subprotocols=['streamlit'], max_size=None) as websocket:
+                await self._rerun(websocket, 'open')
+                while time.perf_counter() < deadline:
+                    await self._rerun(websocket, self._next_action())
+                    if self.think_time:
+                        await asyncio.sleep(self.random.expovariate(1 / self.think_time))
+        except (asyncio.TimeoutError, OSError, websockets.exceptions.WebSocketException):
+            self.errors += 1
+
+
+def _process_usage(pid: int) -> tuple[float, int]:
+    """
+    Return the CPU time (in seconds) and the resident memory (in bytes) of a process, read from `/proc`.
+    """
+    with open(f'/proc/{pid}/stat', 'r') as file:
+        # The command name may contain spaces, so the fields are counted from its closing parenthesis.
+        fields = file.read().rsplit(')', 1)[1].split()
+    cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    with open(f'/proc/{pid}/status', 'r') as file:
+        rss = next(int(line.split()[1]) * 1024 for line in file if line.startswith('VmRSS:'))
+    return cpu_time, rss
+
+
+async def sample_processes(processes: dict, samples: dict, interval: float, stop: asyncio.Event) -> None:
+    """
+    Record the CPU time and the resident memory of `processes` every `interval` seconds, until `stop` is set.
+
+    Arguments:
+        processes: The pids to sample, with their names as the keys.
+        samples: The samples of each process, as a list of (time, CPU time, RSS) tuples.
+    """
+    while True:
+        now = time.perf_counter()
+        for name, pid in processes.items():
+            try:
+                samples.setdefault(name, []).append((now, *_process_usage(pid)))
+            except (FileNotFoundError, ProcessLookupError):
+                pass
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_servers(count: int, base_port: int, script: str = 'main.py') -> list[subprocess.Popen]:
+    """
+    Start `count` Streamlit servers on consecutive ports, and wait until they are healthy.
+    """
+    servers = []
+    for i in range(count):
+        command = [
+            sys.executable, '-m', 'streamlit', 'run', script,
+            '--server.headless', 'true',
+            '--server.port', str(base_port + i),
+            '--server.fileWatcherType', 'none',
+            '--browser.gatherUsageStats', 'false',
+        ]
+        servers.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    deadline = time.time() + 120
+    for i, server in enumerate(servers):
+        while True:
+            if server.poll() is not None:
+                raise Exception(f'The server on port {base_port + i} exited with code {server.returncode}.')
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{base_port + i}/_stcore/health', timeout=1) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                pass
+            if time.time() > deadline:
+                raise Exception(f'The server on port {base_port + i} did not start.')
+            time.sleep(0.5)
+    return servers
+
+
+def summarise(sessions: list[SimulatedSession], samples: dict, duration: float) -> dict:
+    """
+    Compute the throughput, the latency percentiles and the resource usage of a run.
+    """
+    latencies = [latency for session in sessions for latency in session.latencies]
+    report = {
+        'sessions': len(sessions),
+        'duration_s': round(duration, 2),
+        'reruns': len(latencies),
+        'errors': sum(session.errors for session in sessions),
+        'throughput_reruns_per_s': round(len(latencies) / duration, 2),
+        'latency_ms': dict(),
+        'processes': dict(),
+    }
+    groups = {'all': [seconds for _, _, seconds in latencies]}
+    for page, _, seconds in latencies:
+        groups.setdefault(f'page:{page}', []).append(seconds)
+    for _, action, seconds in latencies:
+        groups.setdefault(f'action:{action}', []).append(seconds)
+    for group, values in groups.items():
+        values = np.array(values) * 1000
+        report['latency_ms'][group] = {
+            'count': len(values),
+            'p50': round(float(np.percentile(values, 50)), 1),
+            'p90': round(float(np.percentile(values, 90)), 1),
+            'p95': round(float(np.percentile(values, 95)), 1),
+            'p99': round(float(np.percentile(values, 99)), 1),
+            'max': round(float(values.max()), 1),
+        }
+    for name, process_samples in samples.items():
+        if len(process_samples) < 2:
+            continue
+        (first_time, first_cpu, _), (last_time, last_cpu, _) = process_samples[0], process_samples[-1]
+        rss = [sample_rss for _, _, sample_rss in process_samples]
+        report['processes'][name] = {
+            'cpu_percent': round(100 * (last_cpu - first_cpu) / (last_time - first_time), 1),
+            'rss_mean_mb': round(float(np.mean(rss)) / 2**20, 1),
+            'rss_max_mb': round(max(rss) / 2**20, 1),
+        }
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['sessions']} sessions, {report['duration_s']} s")
+    print(f"{report['reruns']} reruns, {report['errors']} errors, {report['throughput_reruns_per_s']} reruns/s")
+    print(f"\n{'latency (ms)':<28}{'count':>7}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for group, stats in report['latency_ms'].items():
+        print(f"{group:<28}{stats['count']:>7}" + ''.join(f'{stats[key]:>9}' for key in ['p50', 'p90', 'p95', 'p99', 'max']))
+    print(f"\n{'process':<28}{'CPU %':>9}{'RSS mean (MB)':>15}{'RSS max (MB)':>14}")
+    for name, usage in report['processes'].items():
+        print(f"{name:<28}{usage['cpu_percent']:>9}{usage['rss_mean_mb']:>15}{usage['rss_max_mb']:>14}")
+
+
+async def run_load_test(ports: list[int], processes: dict, sessions: int, duration: float, think_time: float,
+                        ramp_up: float, timeout: float, seed: int) -> dict:
+    """
+    Run `sessions` simulated sessions for `duration` seconds, spread over the servers listening on `ports`.
+    """
+    simulated = [
+        SimulatedSession(f'ws://127.0.0.1:{ports[i % len(ports)]}/_stcore/stream', seed + i, think_time, timeout)
+        for i in range(sessions)
+    ]
+    samples, stop = dict(), asyncio.Event()
+    sampler = asyncio.create_task(sample_processes(processes, samples, interval=0.5, stop=stop))
+
+    async def start_session(i: int, session: SimulatedSession, deadline: float) -> None:
+        # The sessions are started gradually, rather than all at once.
+        await asyncio.sleep(ramp_up * i / max(sessions, 1))
+        await session.run(deadline)
+
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[start_session(i, session, deadline) for i, session in enumerate(simulated)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await sampler
+    return summarise(simulated, samples, elapsed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive concurrent simulated sessions against a local instance of the app.')
+    parser.add_argument('--sessions', type=int, default=10, help='The number of concurrent sessions.')
+    parser.add_argument('--duration', type=float, default=60, help='How long the sessions run for, in seconds.')
+    parser.add_argument('--think-time', type=float, default=0.5, help='The mean pause between the actions of a session, in seconds.')
+    parser.add_argument('--ramp-up', type=float, default=5, help='The time over which the sessions are started, in seconds.')
+    parser.add_argument('--servers', type=int, default=1, help='The number of server processes, the sessions are spread over them.')
+    parser.add_argument('--port', type=int, default=8600, help='The port of the first server.')
+    parser.add_argument('--timeout', type=float, default=120, help='The time after which a rerun is considered failed, in seconds.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the actions of the sessions.')
+    parser.add_argument('--json', default=None, help='A file to write the report to, as JSON.')
+    args = parser.parse_args()
+
+    if websockets is None:
+        raise ImportError('The load test requires the `websockets` package to be installed.')
+    servers = start_servers(args.servers, args.port)
+    try:
+        ports = [args.port + i for i in range(args.servers)]
+        processes = {f'server:{port}': server.pid for port, server in zip(ports, servers)}
+        processes['load_test'] = os.getpid()
+        report = asyncio.run(run_load_test(
+            ports, processes, args.sessions, args.duration, args.think_time, args.ramp_up, args.timeout, args.seed
+        ))
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+    print_report(report)
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
@@ -7,6 +7,7 @@ import plotly.io as io
 import plotly.graph_objects as go
 import pycountry_convert
 import streamlit as st
+from utils import load_dataset
 
 
 st.set_page_config(layout="wide")
@@ -23,5 +24,5 @@ df_old = pd.read_parquet('Result_file_compressed.parquet')
 st.dataframe(df_old)
 
 st.write('This is what the processed dataset looks like:')
-df_new = pd.read_csv('Processed_dataset/Crash_data_new.csv')
+df_new = load_dataset()
 st.dataframe(df_new)
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+A module describing the pages of the dashboard: the measure each of them shows, which charts are drawn for a filter
+dictionary (see `filters.py`), and the aggregations each chart requests.
+
+The Streamlit pages (`page_template.py`), the static export (`export.py`), the rollups (`rollups.py`) and the
+prefetcher (`prefetch.py`) are all derived from it, so that they draw, precompute and prefetch the same aggregations.
+"""
+from filters import narrow_filters, single_value
+from utils import ADDITIVE_AGG_FUNCS
+
+# The measure, the aggregation function and the options of each page, as given to `Template`.
+PAGES = {
+    'Crashes': {'title': 'Number of crashes', 'measure': 'Crashes', 'agg_func': None, 'target_type': None, 'treemap_flag': True},
+    'Deaths': {'title': 'Number of fatalities', 'measure': 'Total_fatalities', 'agg_func': 'sum', 'target_type': None, 'treemap_flag': True},
+    'Survival_rates': {'title': 'Survival rates', 'measure': 'Survival_rate', 'agg_func': 'mean', 'target_type': None, 'treemap_flag': False},
+}
+
+# The histograms of the date tabs, with the column they are grouped by and their title.
+DATE_HISTOGRAMS = {
+    'decade': ('Decade', 'Per decade'),
+    'month': ('Month', 'Per month'),
+    'day': ('Day', 'Per day number'),
+    'day_of_week': ('Day_of_week', 'Per day'),
+}
+
+# The heatmaps, with their title.
+HEATMAPS = {
+    'heatmap-year-month': 'Year and month',
+    'heatmap-month-day': 'Month and day',
+    'heatmap-month-day-number': 'Month and day number',
+}
+
+# The aggregations requested by each chart, as (grouping columns, US flag, partial states).
+CHART_AGGREGATIONS = {
+    'year': [('Year', None, False)],
+    'decade': [('Decade', None, False)],
+    'month': [('Month', None, False)],
+    'day': [('Day', None, False)],
+    'day_of_week': [('Day_of_week', None, False)],
+    'time': [('Time', None, True)],
+    'world-map': [('Country', None, False)],
+    'us-map': [('US_State', True, False)],
+    'heatmap-year-month': [(['Year', 'Month'], None, False)],
+    'heatmap-month-day': [(['Month', 'Day_of_week'], None, False)],
+    'heatmap-month-day-number': [(['Month', 'Day'], None, False)],
+    'treemap-country': [('Country', None, False)],
+    'treemap-continent-country': [(['Continent', 'Country'], None, False)],
+}
+
+# The charts which fold their smallest nodes, from the partial states of the measure when it is not additive.
+FOLDED_CHARTS = ['treemap-country', 'treemap-continent-country']
+
+
+def page_charts(filters: dict, treemap_flag: bool = True) -> list[str]:
+    """
+    List the charts of a page for the given filters.
+
+    A chart of a date unit is not drawn if only one value of that unit is selected, the maps are not drawn for a single
+    country, and the heatmaps are only drawn if all or none of the date filters are applied.
+
+    Arguments:
+        filters: The filter dictionary of the page.
+        treemap_flag: Whether the page has treemaps.
+
+    Returns:
+        The names of the charts, keys of `CHART_AGGREGATIONS`, in the order of the page.
+    """
+    charts = []
+    if not single_value(filters, 'Year'):
+        charts.append('year')
+    charts.extend(chart for chart, (column, _) in DATE_HISTOGRAMS.items() if not single_value(filters, column))
+    charts.append('time')
+
+    countries, continents = filters.get('Country', []), filters.get('Continent', [])
+    if len(countries) != 1:
+        charts.append('world-map')
+        if ('United States of America' in countries or 'North America' in continents or
+            'Country' not in filters and 'Continent' not in filters):
+            charts.append('us-map')
+
+    date_filters = [column in filters for column in ['Year', 'Month', 'Day_of_week', 'Day']]
+    if all(date_filters) or not any(date_filters):
+        charts.extend(HEATMAPS)
+
+    if treemap_flag and 'Country' not in filters:
+        charts.extend(FOLDED_CHARTS)
+    return charts
+
+
+def page_aggregations(filters: dict, agg_func: str, treemap_flag: bool = True) -> list[tuple]:
+    """
+    List the aggregations requested by the charts of a page for the given filters, without duplicates.
+
+    Arguments:
+        filters: The filter dictionary of the page.
+        agg_func: The aggregation function of the page.
+        treemap_flag: Whether the page has treemaps.
+
+    Returns:
+        A list of (grouping columns, US flag, partial states), as passed to `PlotMaker.aggregate_dataframe`.
+    """
+    aggregations = []
+    for chart in page_charts(filters, treemap_flag):
+        for grouping_cols, us_flag, partial in CHART_AGGREGATIONS[chart]:
+            partial = partial or chart in FOLDED_CHARTS and agg_func not in ADDITIVE_AGG_FUNCS
+            if (grouping_cols, us_flag, partial) not in aggregations:
+                aggregations.append((grouping_cols, us_flag, partial))
+    return aggregations
+
+
+def rollup_groupings() -> list[tuple]:
+    """
+    List the groupings of every aggregation of the unfiltered pages, with the filters they are applied with.
+
+    The finer groupings come first, so that the coarser ones can be derived from them.
+
+    Returns:
+        A list of (grouping columns, filters).
+    """
+    groupings = []
+    for grouping_cols, us_flag, _ in page_aggregations(dict(), agg_func=None):
+        grouping_cols = grouping_cols if isinstance(grouping_cols, list) else [grouping_cols]
+        filters = narrow_filters(dict(), 'Country', ['United States of America']) if us_flag else dict()
+        if (grouping_cols, filters) not in groupings:
+            groupings.append((grouping_cols, filters))
+    return sorted(groupings, key=lambda grouping: -len(grouping[0]))
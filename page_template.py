@@ -1,20 +1,35 @@
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-import pandas as pd
-from utils import aggregate_columns, find_crash_counts
+import os
+from page_spec import PAGES, DATE_HISTOGRAMS, HEATMAPS, page_charts
 from plot_creator import PlotMaker
+from prefetch import get_prefetcher
+from query_api import ENGINE, options
 from collections import namedtuple
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 
-# LOAD THE DATASET
-df = pd.read_parquet('Processed_dataset/Crash_data_new.parquet')
+# Whether to prefetch the aggregations of the filters likely to be selected next, once a page is drawn.
+PREFETCH = os.environ.get('CRASH_DATA_PREFETCH', '0') == '1'
+
+
+def _session_id() -> str:
+    """
+    Return the id of the browser session running the page, which identifies its prefetching.
+    """
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
 
 class Template:
     
-    def __init__(self, measure, agg_func):
+    def __init__(self, measure, agg_func, engine: str = ENGINE):
+        # The prefetching must not slow down the rerun that starts now.
+        if PREFETCH:
+            get_prefetcher(engine).cancel(_session_id())
+        self.engine = engine
         st.set_page_config(layout="wide")
-        self.df = df
         with open('Colours_list_real.txt', 'r') as file:
             values = file.readlines()
             self.CSS_colours = [value.strip() for value in values]
@@ -27,7 +42,7 @@ class Template:
         self.heatmap_colour_default = self.continuous_colours.index('jet')
         
         self._make_sidebar()
-        self.plotter = PlotMaker(df=self.df, measure=measure, agg_func=agg_func, continuous_colour=self.heatmap_colour, discrete_colour=self.plot_colour)
+        self.plotter = PlotMaker(measure=measure, agg_func=agg_func, continuous_colour=self.heatmap_colour, discrete_colour=self.plot_colour, engine=engine)
     
     def _make_sidebar(self) -> None:
         """
@@ -61,80 +76,93 @@ class Template:
     def _make_filters(self) -> None:
         """
         Make all the checkbox filters that appear right below the title.
+
+        Years and decades are selected as ranges, the other filters accept multiple values.
         """
         st.markdown('Apply the filters you want.')
-        col1, col2, col3, col4, col5, col6, col7= st.columns(7)
+        col1, col2, col3, col4, col5, col6, col7, col8, col9 = st.columns(9)
         with col1:
             self.country_filter = st.checkbox(label='Country/Region', value=False)
         with col2:
             self.continent_filter = st.checkbox(label='Continent', value=False)
         with col3:
-            self.year_filter = st.checkbox(label='Year', value=False)
+            self.operator_filter = st.checkbox(label='Operator', value=False)
         with col4:
-            self.month_filter = st.checkbox(label='Month', value=False)
+            self.aircraft_filter = st.checkbox(label='Aircraft type', value=False)
         with col5:
-            self.day_filter = st.checkbox(label='Day of week', value=False)
+            self.year_filter = st.checkbox(label='Year', value=False)
         with col6:
-            self.day_num_filter = st.checkbox(label='Day', value=False)
+            self.month_filter = st.checkbox(label='Month', value=False)
         with col7:
+            self.day_filter = st.checkbox(label='Day of week', value=False)
+        with col8:
+            self.day_num_filter = st.checkbox(label='Day', value=False)
+        with col9:
             self.decade_filter = st.checkbox(label='Decade', value=False)
 
         self.passenger_filter = st.checkbox(label='Commercial flights', value=False)
             
-        self.location_filters = [self.country_filter, self.continent_filter]
+        # The selections of all the applied filters, in the form used by `FilterIndex.select`.
+        self.filters = dict(self.extra_filters)
 
-        # Create the options for the selectboxes
-        # For locations
-        self.df['Continent'] = self.df['Continent'].fillna(value='Unknown')
-        country_list = sorted(self.df['Country'].unique())
-        continent_list = sorted(self.df['Continent'].unique())
-        self.selected_country, self.selected_continent = False, False
-        
-        # For dates
-        year_list = sorted(self.df['Date'].dt.year.unique())
-        month_list = self.df['Month'].sort_values().unique().tolist()
-        day_list = self.df['Day_of_week'].sort_values().unique().tolist()
-        day_num_list = sorted(self.df['Date'].dt.day.unique())
-        decade_list = sorted(self.df['Decade'].unique())
-        self.selected_year, self.selected_month, self.selected_day, self.selected_day_num, self.selected_decade = [False for _ in range(5)]
-
-        # Make filters for locations
+        # Make filters for locations, operators and aircraft types
         if self.country_filter:
-            self.selected_country = st.selectbox(label='Select the country (or region)', options=country_list)
-            self.plotter.df = self.plotter.df.query("Country in @self.selected_country")
+            self._make_multiselect('Country', 'Select the countries (or regions)')
         if self.continent_filter:
-            self.selected_continent = st.selectbox(label='Select the continent', options=continent_list)
-            self.plotter.df = self.plotter.df.query('Continent in @self.selected_continent')
+            self._make_multiselect('Continent', 'Select the continents')
+        if self.operator_filter:
+            self._make_multiselect('Operator', 'Select the operators')
+        if self.aircraft_filter:
+            self._make_multiselect('AC_Type', 'Select the aircraft types')
             
         # Make filters for date and times
         if self.year_filter:
-            self.selected_year = st.selectbox(label='Select the year', options=year_list)
-            self.plotter.df = self.plotter.df.query("Date.dt.year == @self.selected_year")
+            year_list = options('Year', self.engine)
+            self.filters['Year'] = st.slider(
+                label='Select the years',
+                min_value=year_list[0], max_value=year_list[-1],
+                value=(year_list[0], year_list[-1])
+            )
         if self.month_filter:
-            self.selected_month = st.selectbox(label='Select the month', options=month_list)
-            self.plotter.df = self.plotter.df.query("Month == @self.selected_month")
+            self._make_multiselect('Month', 'Select the months')
         if self.day_filter:
-            self.selected_day = st.selectbox(label='Select the day', options=day_list)
-            self.plotter.df = self.plotter.df.query("Day_of_week == @self.selected_day")
+            self._make_multiselect('Day_of_week', 'Select the days')
         if self.day_num_filter:
-            self.selected_day_num = st.selectbox(label='Select the day number', options=day_num_list)
-            self.plotter.df = self.plotter.df.query("Date.dt.day == @self.selected_day_num")
+            self._make_multiselect('Day', 'Select the day numbers')
         if self.decade_filter:
-            self.selected_decade = st.selectbox(label='Select the decade', options=decade_list)
-            self.plotter.df = self.plotter.df.query("Decade == @self.selected_decade")
+            decade_list = options('Decade', self.engine)
+            self.filters['Decade'] = st.slider(
+                label='Select the decades',
+                min_value=decade_list[0], max_value=decade_list[-1],
+                value=(decade_list[0], decade_list[-1]),
+                step=10
+            )
             
         # For non-military flights
         if self.passenger_filter:
-            self.plotter.df = self.plotter.df.query('Type == "Passenger"')
+            self.filters['Type'] = ['Passenger']
+
+        self.plotter.filters = self.filters
+            
+    def _make_multiselect(self, column: str, label: str) -> None:
+        """
+        Make a multiselect filter of the values of `column`.
+
+        Nothing is filtered until a value is selected, so that the charts are not emptied as soon as the filter is
+        ticked.
+        """
+        selection = st.multiselect(label=label, options=options(column, self.engine))
+        if selection:
+            self.filters[column] = selection
             
     def _make_year_line_plot(self) -> None:
         """
         Make the line graph, with year on the x-axis.
         
-        Not shown if a year filter is applied.
+        Not shown if a single year is selected.
         """
         st.markdown('## By year')
-        self.plotter.draw_line_plot(grouping_col=self.plotter.df['Date'].dt.year, title='Per year', date_name='Year', height=self.figure_height)
+        self.plotter.draw_line_plot(grouping_col='Year', title='Per year', height=self.figure_height)
         
     def _make_main_title(self, title) -> None:
         """
@@ -148,11 +176,11 @@ class Template:
 
         Decade, month, day of the week, day number and time of day.
         
-        If a particular time unit is applied as a filtered, then the graph is not shown.
+        If only one value of a particular time unit is selected in the filters, then the graph is not shown.
         
-        For example, if you apply a 2000 decade filter, then the decade graph is not shown.
+        For example, if you select only the 2000 decade, then the decade graph is not shown.
         
-        If you apply a Sunday filter, then the day of the week graph is not shown, as so on and so forth.
+        If you select only Sunday, then the day of the week graph is not shown, as so on and so forth.
         """
         st.markdown('## By date or time')
         decade_tab, month_tab, day_tab, day_num_tab, time_tab = st.tabs([
@@ -161,50 +189,14 @@ class Template:
         
         # If a particular date filter is applied, omit making the corresponding graph since it has only one column.
         error_message = '## Not applicable because of the applied filter(s).'
-        tabs_info = [
-            {
-               'tab_name': decade_tab, 
-                'filter': self.decade_filter, 
-                'grouping_column': 'Decade',
-                'title': 'Per decade', 
-                'nbins': 15, 
-            },
-            {
-                'tab_name': month_tab, 
-                'filter': self.month_filter, 
-                'grouping_column': 'Month',
-                'title': 'Per month', 
-                'nbins': 7,
-            },
-            {
-                'tab_name': day_num_tab, 
-                'filter': self.day_num_filter, 
-                'grouping_column': self.df['Date'].dt.day,
-                'title': 'Per day number', 
-                'nbins': 31,
-                'date_name': 'Day',
-            },
-            {
-                'tab_name': day_tab, 
-                'filter': self.day_filter, 
-                'grouping_column': 'Day_of_week',
-                'title': 'Per day', 
-                'nbins': 12,
-            },
-        ]
+        tabs = {'decade': decade_tab, 'month': month_tab, 'day': day_num_tab, 'day_of_week': day_tab}
         
-        for tab_info in tabs_info:
-            with tab_info['tab_name']:
-                if tab_info['filter']:
+        for chart, (grouping_column, title) in DATE_HISTOGRAMS.items():
+            with tabs[chart]:
+                if chart not in self.charts:
                     st.write(error_message)
                     continue
-                self.plotter.draw_histogram(
-                    grouping_col=tab_info.get('grouping_column'),
-                    title=tab_info.get('title'),
-                    nbins=tab_info.get('nbins'),
-                    date_name=tab_info.get('date_name'),
-                    height=self.figure_height
-                )
+                self.plotter.draw_histogram(grouping_col=grouping_column, title=title, height=self.figure_height)
 
         # Give an explanation about the x-axis of the time histogram.
         time_tab_message = """
@@ -221,8 +213,8 @@ class Template:
         """
         Make the world maps and US state maps.
         """
-        # Create a worldmap only if all an individual country is not selected
-        if self.selected_country:
+        # Create a worldmap only if an individual country is not selected
+        if 'world-map' not in self.charts:
             return
         st.markdown('## By countries')
         us_exclude_flag = st.checkbox('Exclude the US from world map?')
@@ -237,9 +229,7 @@ class Template:
         self.plotter.draw_world_map(us_exclude_flag=us_exclude_flag, grouping_col='Country', title='Crashes throughout the world')
         
         # Show the map of US only if all countries are selected or North America has been selected.
-        if (self.selected_country == 'United States of America' or
-            self.selected_continent == 'North America' or
-            not any(self.location_filters)):
+        if 'us-map' in self.charts:
             st.markdown('## By US states')
             self.plotter.draw_US_map(title='Crashes throughout the US')
             
@@ -256,9 +246,8 @@ class Template:
         Arguments:
             type_conversion: The target type of the measure column. Must be one of `int32`, `float64` or `None`
         """
-        date_filters = [self.year_filter, self.month_filter, self.day_filter, self.day_num_filter]
-        condition = all(date_filters) or not any(date_filters)
-        if not condition:
+        # Only shown if all or none of the date filters are applied.
+        if 'heatmap-year-month' not in self.charts:
             return
         st.markdown('## Heatmaps')
         self.show_values = st.checkbox('Show values?', value=False)
@@ -267,9 +256,9 @@ class Template:
         ])
         Kwargs = namedtuple('Kwargs', ['title'])
         tabs_info = [
-            (year_month, self.plotter.draw_heatmap_year_month, Kwargs('Year and month')),
-            (month_day, self.plotter.draw_heatmap_month_day, Kwargs('Month and day')),
-            (month_day_number, self.plotter.draw_heatmap_month_day_number, Kwargs('Month and day number'))
+            (year_month, self.plotter.draw_heatmap_year_month, Kwargs(HEATMAPS['heatmap-year-month'])),
+            (month_day, self.plotter.draw_heatmap_month_day, Kwargs(HEATMAPS['heatmap-month-day'])),
+            (month_day_number, self.plotter.draw_heatmap_month_day_number, Kwargs(HEATMAPS['heatmap-month-day-number']))
         ]
         
         for tab_name, function, arguments in tabs_info:
@@ -279,31 +268,59 @@ class Template:
     def _make_treemaps(self) -> None:
         """
         Make country-wise and continent+country-wise treemaps.
+        
+        The smallest countries are folded into an "Other" node, so that the number of nodes stays bounded.
         """
-        if self.country_filter:
+        if 'treemap-country' not in self.charts:
             return
         st.markdown('## Treemaps')
         us_exclude = st.checkbox('Ignore the US?', value=False)
-        self.plotter.draw_country_treemap(height=self.figure_height, us_exclude_flag=us_exclude)
-        self.plotter.draw_continent_country_treemap(height=self.figure_height, us_exclude_flag=us_exclude)
+        col1, col2 = st.columns(2)
+        with col1:
+            threshold = st.number_input(label=f'Enter the threshold value for `{self.plotter.measure}`', key=1, step=1, min_value=1)
+        with col2:
+            top_k = st.number_input(label='Enter the maximum number of countries (per continent)', key=2, step=1, min_value=1, value=25)
+        treemap_kwargs = dict(height=self.figure_height, us_exclude_flag=us_exclude, threshold=threshold, top_k=top_k, min_share=0.001)
+        self.plotter.draw_country_treemap(**treemap_kwargs)
+        self.plotter.draw_continent_country_treemap(**treemap_kwargs)
         
 
     def make_page(
         self, 
         main_title: str, 
         target_type: str, 
-        treemap_flag: bool = True
+        treemap_flag: bool = True,
+        extra_filters: dict = None
     ) -> None:
         """
         ...make the page.
+        
+        Arguments:
+            main_title: The title of the page.
+            target_type: The target type of the measure column in heatmaps. Must be one of `int32`, `float64` or `None`
+            treemap_flag: Whether to make the treemaps.
+            extra_filters: Filters applied in addition to the ones selected on the page, for example the rows found by
+                the search page.
         """
+        self.extra_filters = extra_filters or dict()
         self._make_main_title(main_title)
         self._make_filters()
-        if not self.year_filter:
+        # The charts drawn for the selected filters, see `page_spec.py`.
+        self.charts = page_charts(self.filters, treemap_flag)
+        if 'year' in self.charts:
             self._make_year_line_plot()
         self._make_date_tabs()
         self._make_geo_maps()
         self._make_heatmaps(target_type)
-        if treemap_flag:
-            self._make_treemaps()
-        
\ No newline at end of file
+        self._make_treemaps()
+        if PREFETCH:
+            get_prefetcher(self.engine).prefetch(_session_id(), self.plotter.measure, self.plotter.agg_func, self.filters, treemap_flag)
+
+
+def make_dashboard_page(page_name: str) -> None:
+    """
+    Make one of the pages of `PAGES`.
+    """
+    page = PAGES[page_name]
+    template = Template(measure=page['measure'], agg_func=page['agg_func'])
+    template.make_page(main_title=page['title'], target_type=page['target_type'], treemap_flag=page['treemap_flag'])
@@ -1,4 +1,3 @@
-from page_template import Template
+from page_template import make_dashboard_page
 
-page = Template(measure='Crashes', agg_func=None)
-page.make_page(main_title='Number of crashes', target_type=None)
\ No newline at end of file
+make_dashboard_page('Crashes')
\ No newline at end of file
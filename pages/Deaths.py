@@ -1,4 +1,3 @@
-from page_template import Template
+from page_template import make_dashboard_page
 
-page = Template(measure='Total_fatalities', agg_func='sum')
-page.make_page(main_title='Number of fatalities', target_type=None)
\ No newline at end of file
+make_dashboard_page('Deaths')
\ No newline at end of file
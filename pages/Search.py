@@ -0,0 +1,31 @@
+import streamlit as st
+from page_template import Template
+from search_index import get_search_index
+
+page = Template(measure='Crashes', agg_func=None)
+
+st.markdown('# Search')
+search_index = get_search_index()
+if search_index is None:
+    st.write('The search index has not been built for this dataset. Run `python search_index.py` to build it.')
+    st.stop()
+
+with st.expander('Query syntax'):
+    st.markdown("""
+        `aeroflot tupolev`: crashes matching both terms \n
+        `boeing OR airbus`: crashes matching either term \n
+        `boeing -cargo` or `boeing NOT cargo`: crashes matching `boeing` but not `cargo` \n
+        `engin*`: crashes with a word starting with `engin` \n
+        `operator:aeroflot`: `aeroflot` in the operator only. The fields are `operator`, `ac_type`, `registration`, 
+        `flight_no` and `summary`.
+    """)
+query = st.text_input(label='Search the operators, aircraft types, registrations, flight numbers and summaries')
+if not query:
+    st.stop()
+
+row_ids = search_index.search(query)
+st.write(f'{len(row_ids)} crashes found.')
+if len(row_ids) == 0:
+    st.stop()
+
+page.make_page(main_title='Matching crashes', target_type=None, extra_filters={'Row_id': row_ids.tolist()})
@@ -1,4 +1,3 @@
-from page_template import Template
+from page_template import make_dashboard_page
 
-page = Template(measure='Survival_rate', agg_func='mean')
-page.make_page(main_title='Survival rates', target_type=None, treemap_flag=False)
\ No newline at end of file
+make_dashboard_page('Survival_rates')
\ No newline at end of file
@@ -2,7 +2,9 @@
 A module which aims to use OOP to reuse code in all three visualisation pages
 """
 import streamlit as st
-from utils import find_crash_counts, aggregate_columns
+from filters import narrow_filters
+from query_api import query
+from utils import prune_nodes, merge_partials, finalise_partials, partial_fold_funcs, ADDITIVE_AGG_FUNCS, MERGEABLE_AGG_FUNCS
 import pandas as pd
 import plotly.express as px
 import json
@@ -14,23 +16,33 @@ class PlotMaker:
     
     def __init__(
         self, 
-        df: pd.DataFrame,
         measure: str,
         agg_func: str, 
         continuous_colour: str, 
-        discrete_colour: str
+        discrete_colour: str,
+        engine: str = 'pandas',
+        use_rollups: bool = True,
+        figure_sink=None,
+        prefetching: bool = False
     ):
         """
         Arguments:
-            df: The dataframe to be used.
-            grouping_cols: The list of columns to group by.
             measure: The numeric data to be aggregated.
             agg_func: The aggregated function to be applied.
             continuous_colour: The colour to be used in heatmaps.
             discrete_colour: The colour to be used in non-heatmap plots.
-            date_name: An alias of the date column.
+            engine: The engine that runs the aggregations. Must be one of `pandas` or `duckdb`.
+            use_rollups: Whether to serve the aggregations of the unfiltered page from the precomputed rollups.
+            figure_sink: A function which receives the figures instead of Streamlit, for example to export them.
+            prefetching: Whether the aggregations are computed in the background by the prefetcher, rather than for
+                a page being drawn.
         """
-        self.df = df
+        self.engine = engine
+        self.use_rollups = use_rollups
+        self.prefetching = prefetching
+        self.figure_sink = figure_sink
+        # The filters applied to the dataset, in the form used by `FilterIndex.select`.
+        self.filters = dict()
         self.measure = measure
         self.agg_func = agg_func
         self.continuous_colour = continuous_colour
@@ -40,88 +52,131 @@ class PlotMaker:
             'float64': np.float64
         }
         
-    def aggregate_dataframe(self, grouping_cols: list[str], date_name: str=None, us_flag=None):
+    def _show(self, fig: go.Figure) -> None:
         """
-        Aggregates the dataframe by the provided grouping columns and measure.
+        Show the figure in the app, or pass it to the figure sink if there is one.
+        """
+        if self.figure_sink is not None:
+            self.figure_sink(fig)
+        else:
+            st.plotly_chart(fig, use_container_width=True)
+        
+    def aggregate_dataframe(self, grouping_cols: list[str], us_flag=None, partial: bool = False):
+        """
+        Aggregates the filtered dataset by the provided grouping columns and measure, using the query API.
         
         Arguments:
-            grouping_cols: The columns to group by.
-            date_name: Renames the `Date` column to `date_name`
-            us_flag: Whether to include the US in maps.
+            grouping_cols: The columns to group by. `Year` and `Day` are derived from the `Date` column.
+            us_flag: Whether to include only the US in maps.
+            partial: Whether to return the mergeable partial states of the measure instead of its final value.
+                The crash counts are their own partial states.
         """
-        if us_flag is None:
-            df_to_use = self.df
-        else:
-            df_to_use = self.df.query('Country == "United States of America"')
+        filters = self.filters
+        if us_flag is not None:
+            filters = narrow_filters(filters, 'Country', ['United States of America'])
+        return query(
+            grouping_cols=grouping_cols,
+            measure=self.measure,
+            agg_func=self.agg_func,
+            filters=filters,
+            engine=self.engine,
+            partial=partial,
+            use_rollups=self.use_rollups,
+            prefetching=self.prefetching
+        )
+
+    def aggregate_binned(self, grouping_col: str, to_bin) -> pd.DataFrame:
+        """
+        Aggregates the filtered dataset by `grouping_col`, and then merges the groups into bins.
+        
+        The bins are computed from the partial states of the measure, so that, for example, the mean of a bin is the
+        mean of all of its rows and not the mean of the means of its groups.
+        
+        Arguments:
+            grouping_col: The column to group by.
+            to_bin: A function which maps the values of `grouping_col` to the values of their bins.
+        """
+        df_partial = self.aggregate_dataframe(grouping_cols=grouping_col, partial=True)
+        df_partial[grouping_col] = to_bin(df_partial[grouping_col])
         if self.agg_func is None:
-            df_agg = find_crash_counts(
-                df=df_to_use,
-                grouping_cols=grouping_cols,
-                date_name=date_name
-            )
-        else:
-            df_agg = aggregate_columns(
-                df=df_to_use,
-                column_names=grouping_cols,
-                agg_func=self.agg_func,
-                value_column=self.measure,
-                date_name=date_name
-            )
-        return df_agg
+            return merge_partials(df_partial, grouping_col, value_columns=[self.measure])
+        return finalise_partials(merge_partials(df_partial, grouping_col), self.measure, self.agg_func)
+    
+    def aggregate_pruned(self, grouping_cols: list[str], us_exclude_flag: bool, **prune_kwargs) -> pd.DataFrame:
+        """
+        Aggregates the filtered dataset by `grouping_cols`, and folds the smallest countries into an "Other" node with
+        `prune_nodes`.
+        
+        The values of an additive measure are summed into the "Other" node. Otherwise, the node is computed from the
+        partial states of the folded countries, so that, for example, its mean is the mean of all of their rows.
+        
+        Arguments:
+            grouping_cols: The columns to group by, the last one being `Country`.
+            us_exclude_flag: Whether to exclude the US.
+            prune_kwargs: The arguments of `prune_nodes`.
+        """
+        partial = self.agg_func not in ADDITIVE_AGG_FUNCS
+        if partial and self.agg_func not in MERGEABLE_AGG_FUNCS:
+            raise Exception(f'The countries cannot be folded when aggregated by `{self.agg_func}`.')
+        df_agg = self.aggregate_dataframe(grouping_cols=grouping_cols, partial=partial)
+        if us_exclude_flag:
+            df_agg = df_agg[df_agg['Country'] != 'United States of America']
+        if not partial:
+            return prune_nodes(df=df_agg, value_column=self.measure, label_column='Country', **prune_kwargs)
+        df_agg = df_agg.assign(**{self.measure: finalise_partials(df_agg, self.measure, self.agg_func)[self.measure]})
+        df_pruned = prune_nodes(
+            df=df_agg,
+            value_column=self.measure,
+            label_column='Country',
+            fold_funcs=partial_fold_funcs(self.measure),
+            **prune_kwargs
+        )
+        return finalise_partials(df_pruned.drop(columns=self.measure), self.measure, self.agg_func)
     
-    def draw_histogram(self, grouping_col: str, title: str, nbins: int, date_name: str = None, height: int = None):
+    def draw_histogram(self, grouping_col: str, title: str, height: int = None):
         """
         Draw a histogram with `grouping_col` on the x-axis, and `measure` on the y-axis.
         
+        Each value of `grouping_col` gets its own bar, whose height is the aggregated measure of that value.
+        
         Arguments:
             grouping_col: The column by which to perform hte aggregation.
             title: The title of the graph
-            nbins: The number of bins in the histogram
-            date_name: The name to replace the `Date` column, if aggregation is done by a date column.
             height: The height of the figure.
         """
-        df_agg = self.aggregate_dataframe(grouping_cols=grouping_col, date_name=date_name)
-        x = grouping_col if date_name is None else date_name
-        hist_funcs_map = {
-            'sum': 'sum',
-            'mean': 'avg'
-        }
-        hist_func = hist_funcs_map.get(self.agg_func)
-        fig = px.histogram(    
+        df_agg = self.aggregate_dataframe(grouping_cols=grouping_col)
+        fig = px.bar(
             data_frame=df_agg,
-            x=x,
+            x=grouping_col,
             y=self.measure,
             text_auto=True,
-            nbins=nbins,
             title=title,
-            histfunc=hist_func,
             color_discrete_sequence=[self.discrete_colour],
             height=height
         ).update_traces(marker=dict(line=dict(color='black', width=1))).update_layout(bargap=0.2)
-        st.plotly_chart(fig, use_container_width=True)
+        self._show(fig)
         
-    def draw_line_plot(self, grouping_col: str, title: str, date_name: str = None, height: int = None):
+    def draw_line_plot(self, grouping_col: str, title: str, height: int = None):
         """
         Draw a line plot with `grouping_col` on the x-axis, and `measure` on the y-axis.
         
         Arguments:
             grouping_col: The column by which to perform hte aggregation.
             title: The title of the graph
-            date_name: The name to replace the `Date` column, if aggregation is done by a date column.
             height: The height of the figure.
         """
-        df_agg = self.aggregate_dataframe(grouping_cols=grouping_col, date_name=date_name)
+        df_agg = self.aggregate_dataframe(grouping_cols=grouping_col)
         
         fig = px.line(
             data_frame=df_agg,
-            x=date_name,
+            x=grouping_col,
             y=self.measure,
             markers=True,
             title=title,
             color_discrete_sequence=[self.discrete_colour],
             height=height,
         )
-        st.plotly_chart(fig, use_container_width=True)
+        self._show(fig)
         
     def draw_world_map(self, us_exclude_flag, grouping_col: str, title: str):
         """
@@ -132,7 +187,7 @@ class PlotMaker:
             grouping_col: The column to group by.
             title: The title of the figure.
         """
-        df_agg = self.aggregate_dataframe(grouping_cols=grouping_col, date_name=None)
+        df_agg = self.aggregate_dataframe(grouping_cols=grouping_col)
         if us_exclude_flag:
             df_agg = df_agg.query('Country != "United States of America"')
         fig = px.choropleth(
@@ -147,7 +202,7 @@ class PlotMaker:
             title=dict(x=0.5),
             margin=dict(l=0, r=0, t=0, b=0)
         )
-        st.plotly_chart(fig, use_container_width=True)
+        self._show(fig)
         
     def draw_US_map(self, title: str=None):
         """
@@ -171,7 +226,7 @@ class PlotMaker:
             title=dict(x=0.5),
             margin=dict(l=0, r=0, t=0, b=0)
         )
-        st.plotly_chart(fig, use_container_width=True)
+        self._show(fig)
         
     def _return_heatmap(self, matrix: pd.DataFrame, title=None, height: int = None, show_value: bool = False) -> go.Figure:
         """
@@ -214,12 +269,15 @@ class PlotMaker:
             target_type: The type that the measure column should be converted to. Must be one of `int32`, `float64` or `None`
             show_value: Whether to show the values in the cell values.
         """
-        decades = self.df['Decade'].unique().tolist()
+        # Aggregate all the years at once, and split the result into the decades of each heatmap.
+        df_agg_all = self.aggregate_dataframe(grouping_cols=['Year', 'Month'])
+        decade_of_year = df_agg_all['Year'] // 10 * 10
+        decades = sorted(decade_of_year.unique().tolist(), reverse=True)
         decade_values = decades[::-divisions]
 
         for decade in decade_values:
             decade_to_draw = [decade + 10*i for i in range(0, divisions)]
-            df_agg = self.aggregate_dataframe(grouping_cols=[self.df.query('Decade in @decade_to_draw')['Date'].dt.year, 'Month'], date_name='Year')
+            df_agg = df_agg_all[decade_of_year.isin(decade_to_draw)].copy()
             measure_dtype = self.type_map.get(target_type)
             df_agg[self.measure] = df_agg[self.measure].astype(measure_dtype)
             matrix = df_agg.pivot_table(
@@ -228,7 +286,7 @@ class PlotMaker:
                 values=self.measure
             )
             figure = self._return_heatmap(matrix=matrix, title=title, height=height, show_value=show_value)
-            st.plotly_chart(figure, use_container_width=True)
+            self._show(figure)
             
     def draw_heatmap_month_day(self, title=None, height: int = None, target_type: str = None, show_value: bool = False):
         """
@@ -249,7 +307,7 @@ class PlotMaker:
             values=self.measure
         )
         figure = self._return_heatmap(matrix=matrix, title=title, height=height, show_value=show_value)
-        st.plotly_chart(figure, use_container_width=True)
+        self._show(figure)
         
     def draw_heatmap_month_day_number(self, title=None, height: int = None, target_type: str = None, show_value: bool = False):
         """
@@ -261,7 +319,7 @@ class PlotMaker:
             target_type: The type that the measure column should be converted to. Must be one of `int32`, `float64` or `None`
             show_value: Whether to show the values in the cell values.
         """
-        df_agg = self.aggregate_dataframe(grouping_cols=['Month', self.df['Date'].dt.day], date_name='Day')
+        df_agg = self.aggregate_dataframe(grouping_cols=['Month', 'Day'])
         measure_dtype = self.type_map.get(target_type)
         df_agg[self.measure] = df_agg[self.measure].astype(measure_dtype)
         matrix = df_agg.pivot_table(
@@ -270,7 +328,7 @@ class PlotMaker:
             values=self.measure
         )
         figure = self._return_heatmap(matrix=matrix, title=title, height=height, show_value=show_value)
-        st.plotly_chart(figure, use_container_width=True)
+        self._show(figure)
         
     def draw_time_histogram(self, nbins: int, title: str=None, height: int = None):
         """
@@ -281,39 +339,50 @@ class PlotMaker:
             title: The title of the graph
             height: The height of the graph.
         """
-        df_time = self.aggregate_dataframe(grouping_cols='Time')
-        df_time['Time'] = pd.to_datetime(df_time['Time'], format="%H:%M:%S").sort_values()
-        hist_funcs_map = {
-            'sum': 'sum',
-            'mean': 'avg'
-        }
-        hist_func = hist_funcs_map.get(self.agg_func)
-        fig = px.histogram(    
+        bin_width = f'{24 * 60 // nbins}min'
+        df_time = self.aggregate_binned(
+            grouping_col='Time',
+            to_bin=lambda times: pd.to_datetime(times.astype(str), format="%H:%M:%S").dt.floor(bin_width)
+        )
+        fig = px.bar(
             data_frame=df_time,
             x='Time',
             y=self.measure,
             text_auto=True,
-            nbins=nbins,
             title=title,
             color_discrete_sequence=[self.discrete_colour],
-            histfunc=hist_func,
             height=height
         ).update_traces(marker=dict(line=dict(color='black', width=1))).update_layout(bargap=0.2)
-        st.plotly_chart(fig, use_container_width=True)
+        self._show(fig)
         
-    def draw_country_treemap(self, us_exclude_flag: bool = False, height: int = None):
+    def draw_country_treemap(
+        self,
+        us_exclude_flag: bool = False,
+        height: int = None,
+        threshold: int = None,
+        top_k: int = None,
+        min_share: float = 0.0
+    ):
         """
         Draw a country-wise treemap.
         
+        The countries outside the largest `top_k`, below `threshold` or below `min_share` of the total are folded into
+        a single "Other" node.
+        
         Arguments:
             us_exlucde_flag: Whether to exlucde the US in the world map.
             height: The height of the figure.
+            threshold: The minimum value of `measure` for a country to be shown.
+            top_k: The maximum number of countries to be shown.
+            min_share: The minimum share of the total for a country to be shown.
         """
-        df_agg = self.aggregate_dataframe(grouping_cols='Country')
-        if us_exclude_flag:
-            df_agg = df_agg.query('Country != "United States of America"')
-        self.country_treemap_threshold = st.number_input(label=f'Enter the threshold value for `{self.measure}`', key=1, step=1, min_value=1)
-        df_agg = df_agg.query(f'{self.measure} >= @self.country_treemap_threshold')
+        df_agg = self.aggregate_pruned(
+            grouping_cols='Country',
+            us_exclude_flag=us_exclude_flag,
+            top_k=top_k,
+            min_share=min_share,
+            min_value=threshold
+        )
         fig = px.treemap(
             df_agg, 
             path=[px.Constant("world"), 'Country'], 
@@ -323,21 +392,38 @@ class PlotMaker:
             color_continuous_scale=self.continuous_colour,
             height=height
         )
-        st.plotly_chart(fig, use_container_width=True)
+        self._show(fig)
         
-    def draw_continent_country_treemap(self, us_exclude_flag: bool = False, height: int = None):
+    def draw_continent_country_treemap(
+        self,
+        us_exclude_flag: bool = False,
+        height: int = None,
+        threshold: int = None,
+        top_k: int = None,
+        min_share: float = 0.0
+    ):
         """
         Draw a continent and country-wise treemap.
         
+        In each continent, the countries outside the largest `top_k`, below `threshold` or below `min_share` of the
+        continent total are folded into a single "Other" node.
+        
         Arguments:
             us_exlucde_flag: Whether to exlucde the US in the world map.
             height: The height of the figure.
+            threshold: The minimum value of `measure` for a country to be shown.
+            top_k: The maximum number of countries to be shown per continent.
+            min_share: The minimum share of the continent total for a country to be shown.
         """
-        df_agg = self.aggregate_dataframe(grouping_cols=['Continent', 'Country'])
-        if us_exclude_flag:
-            df_agg = df_agg.query('Country != "United States of America"')
+        df_agg = self.aggregate_pruned(
+            grouping_cols=['Continent', 'Country'],
+            us_exclude_flag=us_exclude_flag,
+            top_k=top_k,
+            min_share=min_share,
+            min_value=threshold,
+            group_column='Continent'
+        )
         df_agg[self.measure] = df_agg[self.measure].astype('int32')
-        df_agg = df_agg.query(f'{self.measure} >= @self.country_treemap_threshold')
         fig = px.treemap(
             df_agg, 
             path=[px.Constant("world"), 'Continent', 'Country'], 
@@ -347,4 +433,4 @@ class PlotMaker:
             color_continuous_scale=self.continuous_colour,
             height=height
         )
-        st.plotly_chart(fig, use_container_width=True)
+        self._show(fig)
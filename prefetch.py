@@ -0,0 +1,178 @@
+"""
+A module which prefetches, in the background, the aggregations of the filters a user is likely to select next.
+
+Once a page is drawn, the prefetcher predicts the next filter states:
+
+    The neighbouring year and decade ranges, shifted by one step in each direction.
+    The largest countries, if no country is selected.
+    The continents of the selected countries, if some are.
+
+It then computes the aggregations of every chart of the page for each of them in a small thread pool, into the
+aggregation cache (see `aggregation_cache.py`), so that the next rerun finds them there.
+
+A rerun cancels the prefetching of its session: the pending predictions are dropped, and the running ones stop before
+their next aggregation. The prefetching of the other sessions goes on. The prefetched aggregations never evict the ones requested by a page from the cache.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import os
+import threading
+from filters import narrow_filters
+from page_spec import page_aggregations
+from plot_creator import PlotMaker
+from query_api import options
+
+PREFETCH_WORKERS = int(os.environ.get('CRASH_DATA_PREFETCH_WORKERS', 2))
+
+# The maximum number of filter states prefetched after a page is drawn.
+MAX_STATES = 8
+
+# The number of largest countries whose selection is prefetched.
+TOP_COUNTRIES = 4
+
+
+def _shifted_ranges(filters: dict, column: str, step: int, options: list) -> list[dict]:
+    """
+    Return the filters with the range of `column` shifted by one step in each direction, within `options`.
+    """
+    if column not in filters or not options:
+        return []
+    start, end = filters[column]
+    states = []
+    for shift in [-step, step]:
+        if options[0] <= start + shift and end + shift <= options[-1]:
+            states.append({**filters, column: (start + shift, end + shift)})
+    return states
+
+
+def predict_filters(filters: dict, engine: str) -> list[dict]:
+    """
+    Predict the filters that are likely to be selected after `filters`.
+
+    Arguments:
+        filters: The filters of the page which has just been drawn.
+        engine: The engine that runs the aggregations.
+
+    Returns:
+        A list of filter dictionaries, the most likely first.
+    """
+    # The crash counts per continent and country are used to rank the countries, and are usually in the rollups.
+    counter = PlotMaker(measure='Crashes', agg_func=None, continuous_colour=None, discrete_colour=None, engine=engine, prefetching=True)
+    states = []
+    states.extend(_shifted_ranges(filters, 'Year', 1, options('Year', engine)))
+    states.extend(_shifted_ranges(filters, 'Decade', 10, options('Decade', engine)))
+
+    selected_countries = filters.get('Country')
+    if selected_countries:
+        counter.filters = {column: selection for column, selection in filters.items() if column != 'Country'}
+        df_countries = counter.aggregate_dataframe(grouping_cols=['Continent', 'Country'])
+        continents = df_countries.loc[df_countries['Country'].isin(selected_countries), 'Continent'].unique().tolist()
+        if continents:
+            counter.filters.pop('Continent', None)
+            states.append(narrow_filters(counter.filters, 'Continent', continents))
+    elif 'Country' not in filters:
+        counter.filters = filters
+        df_countries = counter.aggregate_dataframe(grouping_cols=['Continent', 'Country'])
+        top_countries = df_countries.nlargest(TOP_COUNTRIES, 'Crashes')['Country'].tolist()
+        states.extend(narrow_filters(filters, 'Country', [country]) for country in top_countries)
+    return states[:MAX_STATES]
+
+
+class Prefetcher:
+    """
+    Prefetches the aggregations of the predicted filters into the aggregation cache, in a bounded thread pool shared by
+    all the sessions.
+
+    Every session has its own generation, so that the rerun of a session only cancels the prefetching of that session.
+
+    Attributes:
+        engine: The engine that runs the aggregations.
+        executor: The thread pool.
+        generations: The generation of each session, incremented by every cancellation. A task stops as soon as it
+            belongs to an older generation of its session.
+    """
+
+    def __init__(self, engine: str, max_workers: int = PREFETCH_WORKERS):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self.generations = dict()
+        # The pending and running tasks of each session.
+        self._futures = dict()
+        self._lock = threading.Lock()
+
+    def cancel(self, session_id: str) -> int:
+        """
+        Cancel the prefetching of a session, when one of its reruns starts.
+
+        Returns:
+            The new generation of the session.
+        """
+        with self._lock:
+            return self._cancel(session_id)
+
+    def _cancel(self, session_id: str) -> int:
+        generation = self.generations.get(session_id, 0) + 1
+        self.generations[session_id] = generation
+        for future in self._futures.pop(session_id, []):
+            future.cancel()
+        # Forget the sessions which have nothing left to prefetch, since they may have ended.
+        for other_session_id, futures in list(self._futures.items()):
+            if all(future.done() for future in futures):
+                del self._futures[other_session_id]
+        for other_session_id in list(self.generations):
+            if other_session_id != session_id and other_session_id not in self._futures:
+                del self.generations[other_session_id]
+        return generation
+
+    def _is_current(self, session_id: str, generation: int) -> bool:
+        return self.generations.get(session_id) == generation
+
+    def _submit(self, session_id: str, generation: int, function, *args) -> None:
+        with self._lock:
+            if not self._is_current(session_id, generation):
+                return
+            futures = [future for future in self._futures.get(session_id, []) if not future.done()]
+            futures.append(self.executor.submit(function, session_id, generation, *args))
+            self._futures[session_id] = futures
+
+    def prefetch(self, session_id: str, measure: str, agg_func: str, filters: dict, treemap_flag: bool = True) -> None:
+        """
+        Start prefetching the aggregations of the filters likely to follow `filters`, on the page of `measure` and
+        `agg_func`. The previous prefetching of the session is cancelled.
+        """
+        # The first task is submitted with the cancellation, since the session is forgotten by the cancellations of the
+        # other sessions until it has a task.
+        with self._lock:
+            generation = self._cancel(session_id)
+            self._futures[session_id] = [self.executor.submit(
+                self._prefetch_predictions, session_id, generation, measure, agg_func, dict(filters), treemap_flag
+            )]
+
+    def _prefetch_predictions(self, session_id: str, generation: int, measure: str, agg_func: str, filters: dict, treemap_flag: bool) -> None:
+        for state in predict_filters(filters, self.engine):
+            self._submit(session_id, generation, self._prefetch_state, measure, agg_func, state, treemap_flag)
+
+    def _prefetch_state(self, session_id: str, generation: int, measure: str, agg_func: str, filters: dict, treemap_flag: bool) -> None:
+        plotter = PlotMaker(
+            measure=measure,
+            agg_func=agg_func,
+            continuous_colour=None,
+            discrete_colour=None,
+            engine=self.engine,
+            prefetching=True
+        )
+        plotter.filters = filters
+        # Only the aggregations of the charts that the page draws for these filters are computed.
+        for grouping_cols, us_flag, partial in page_aggregations(filters, agg_func, treemap_flag):
+            if not self._is_current(session_id, generation):
+                return
+            plotter.aggregate_dataframe(grouping_cols=grouping_cols, us_flag=us_flag, partial=partial)
+
+
+@lru_cache(maxsize=None)
+def get_prefetcher(engine: str) -> Prefetcher:
+    """
+    Return the prefetcher of `engine`. It is created only once per process, so that the thread pool is shared by all
+    the sessions.
+    """
+    return Prefetcher(engine)
@@ -0,0 +1,126 @@
+"""
+A module containing the query API: the filter and aggregation layer of the pages, without Streamlit, so that the
+aggregations can be reused by scripts, reporting jobs and other services (see `api_server.py`).
+
+    from query_api import query
+    df = query(grouping_cols=['Year'], measure='Total_fatalities', agg_func='sum', filters={'Continent': ['Europe']})
+
+An aggregation is served from the precomputed rollups if it is one of them, then from the aggregation cache of the
+process, and is otherwise computed by the engine and cached.
+"""
+import os
+import pyarrow as pa
+from aggregation_cache import get_aggregation_cache, cache_key
+from backends import get_backend
+from filters import RANGE_FILTERS, CATEGORICAL_FILTERS
+from rollups import get_rollups, rollup_key, PARTIAL
+
+# The engine that runs the aggregations. The dataset is loaded by the engine, once per process.
+ENGINE = os.environ.get('CRASH_DATA_ENGINE', 'pandas')
+
+# The columns the aggregations can be grouped by. `Year` and `Day` are derived from the `Date` column.
+GROUPING_COLUMNS = [
+    'Year', 'Decade', 'Month', 'Day', 'Day_of_week', 'Time', 'Country', 'US_State', 'Continent', 'Operator', 'AC_Type', 'Type'
+]
+
+# The numeric columns which can be aggregated, and `Crashes`, the number of rows.
+MEASURES = [
+    'Crashes', 'Total_fatalities', 'Passengers_fatalities', 'Crew_fatalities', 'Total_abroad', 'Passengers_abroad',
+    'Crew_abroad', 'Total_survivors', 'Passengers_survivors', 'Crew_survivors', 'Ground', 'Survival_rate'
+]
+
+# The aggregation functions which every engine supports.
+AGG_FUNCS = ['sum', 'count', 'mean', 'median', 'min', 'max', 'var', 'std']
+
+# The columns which can be filtered on.
+FILTER_COLUMNS = [*RANGE_FILTERS, *CATEGORICAL_FILTERS, 'Row_id']
+
+
+def validate_query(grouping_cols: list[str], measure: str, agg_func: str, filters: dict) -> None:
+    """
+    Check that the columns and the aggregation function of a query are known, since they are written into the queries
+    of the engines. An Exception is raised otherwise.
+    """
+    for column in grouping_cols:
+        if column not in GROUPING_COLUMNS:
+            raise Exception(f'The grouping column must be one of {GROUPING_COLUMNS}.')
+    if measure not in MEASURES:
+        raise Exception(f'The measure must be one of {MEASURES}.')
+    if agg_func is None:
+        if measure != 'Crashes':
+            raise Exception('An aggregation function is required, except for `Crashes`.')
+    elif measure == 'Crashes':
+        raise Exception('`Crashes` is the number of rows, and takes no aggregation function.')
+    elif agg_func not in AGG_FUNCS:
+        raise Exception(f'The aggregation function must be one of {AGG_FUNCS}.')
+    for column in filters:
+        if column not in FILTER_COLUMNS:
+            raise Exception(f'The filter column must be one of {FILTER_COLUMNS}.')
+
+
+def query(
+    grouping_cols: list[str],
+    measure: str = 'Crashes',
+    agg_func: str = None,
+    filters: dict = None,
+    engine: str = ENGINE,
+    partial: bool = False,
+    use_rollups: bool = True,
+    as_arrow: bool = False,
+    prefetching: bool = False
+):
+    """
+    Aggregate `measure` by `agg_func` for each group of `grouping_cols`, on the rows satisfying `filters`.
+
+    Arguments:
+        grouping_cols: The columns to group by. `Year` and `Day` are derived from the `Date` column.
+        measure: The numeric column to be aggregated, or `Crashes` to count the rows.
+        agg_func: The aggregation function to be applied, `None` to count the rows.
+        filters: The filter dictionary (see `filters.py`). By default, all the rows are aggregated.
+        engine: The engine that runs the aggregations. Must be one of `pandas` or `duckdb`.
+        partial: Whether to return the mergeable partial states of the measure instead of its final value.
+            The crash counts are their own partial states.
+        use_rollups: Whether to serve the aggregation from the precomputed rollups, if it is one of them.
+        as_arrow: Whether to return an Arrow table instead of a pandas DataFrame.
+        prefetching: Whether the aggregation is computed in the background by the prefetcher, rather than requested.
+
+    Returns:
+        A pandas DataFrame (or an Arrow table) with a column for each grouping column, and a column named `measure`
+        (or a column for each partial state).
+        An Exception is raised if a column or the aggregation function is not known (see `validate_query`).
+    """
+    filters = filters or dict()
+    validate_query(grouping_cols if isinstance(grouping_cols, list) else [grouping_cols], measure, agg_func, filters)
+    partial = partial and agg_func is not None
+    stored_agg_func = PARTIAL if partial else agg_func
+
+    df_agg = None
+    if use_rollups:
+        rollup = get_rollups().get(rollup_key(measure, stored_agg_func, grouping_cols, filters))
+        if rollup is not None:
+            # A copy, since some of the plots modify the aggregated dataframe.
+            df_agg = rollup.copy()
+    if df_agg is None:
+        cache = get_aggregation_cache()
+        key = cache_key(engine, measure, stored_agg_func, grouping_cols, filters)
+        df_agg = cache.get(key)
+        if df_agg is None:
+            backend = get_backend(engine)
+            if partial:
+                df_agg = backend.aggregate_partials(grouping_cols=grouping_cols, measure=measure, filters=filters)
+            else:
+                df_agg = backend.aggregate(grouping_cols=grouping_cols, measure=measure, agg_func=agg_func, filters=filters)
+            cache.put(key, df_agg, prefetched=prefetching)
+
+    if as_arrow:
+        return pa.Table.from_pandas(df_agg, preserve_index=False)
+    return df_agg
+
+
+def options(column: str, engine: str = ENGINE) -> list:
+    """
+    Return the sorted list of values that `column` can be filtered by.
+    """
+    if column not in [*RANGE_FILTERS, *CATEGORICAL_FILTERS]:
+        raise Exception(f'The column must be one of {[*RANGE_FILTERS, *CATEGORICAL_FILTERS]}.')
+    return get_backend(engine).options(column)
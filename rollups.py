@@ -0,0 +1,219 @@
+"""
+A module which precomputes the aggregations of the unfiltered pages, so that the default view of a page is served
+without running any groupby.
+
+Run `python rollups.py` after the processed dataset changes to update them. The rollups are stored as one Parquet
+file per aggregation in `Processed_dataset/rollups/`, alongside a manifest containing the version of the rollup
+format and a hash of the dataset they were computed from. Stale or missing rollups are simply not used, including
+when the dataset changes while the app is running.
+
+Besides the final values, the mergeable partial states of each measure are stored too (with `PARTIAL` as the
+aggregation function), and the coarser groupings are derived from the finer ones instead of being recomputed.
+
+Since rows are only ever appended to the partitioned dataset, the rollups of a partitioned dataset are not rebuilt
+after a refresh: the partial states of the appended files are merged into the stored ones (see `update_rollups`).
+"""
+from functools import lru_cache
+import json
+import os
+import pandas as pd
+from backends import get_backend
+from dataset_store import dataset_fingerprint, read_partitioned, select_files
+from filters import FilterIndex, filters_key
+from page_spec import PAGES, rollup_groupings
+from utils import PROCESSED_DATASET, find_crash_counts, merge_partials, finalise_partials, update_partials
+
+ROLLUP_VERSION = 2
+ROLLUP_DIRECTORY = 'Processed_dataset/rollups'
+MANIFEST_FILE = 'manifest.json'
+
+# The aggregation function under which the partial states of a measure are stored.
+PARTIAL = 'partial'
+
+# The groupings (and filters) of every chart that `PlotMaker` draws for an unfiltered page, see `page_spec.py`.
+# A grouping is derived from the first grouping listed before it which contains all of its columns.
+ROLLUP_GROUPINGS = rollup_groupings()
+
+
+def rollup_key(measure: str, agg_func: str, grouping_cols: list[str], filters: dict) -> tuple:
+    """
+    Return the key identifying an aggregation in the rollups.
+    """
+    if not isinstance(grouping_cols, list):
+        grouping_cols = [grouping_cols]
+    return measure, agg_func, tuple(grouping_cols), filters_key(filters)
+
+
+def _page_measures() -> list[tuple]:
+    """
+    Return the distinct (measure, aggregation function) pairs of the pages.
+    """
+    return list(dict.fromkeys((page['measure'], page['agg_func']) for page in PAGES.values()))
+
+
+def _write_tables(directory: str, measure: str, agg_func: str, grouping_cols: list[str], filters: dict, df_partial: pd.DataFrame) -> list[dict]:
+    """
+    Write the rollups of one grouping from its partial states, and return their manifest entries.
+    """
+    if agg_func is None:
+        # The crash counts are their own partial states.
+        df_tables = {agg_func: df_partial}
+    else:
+        df_tables = {agg_func: finalise_partials(df_partial, measure, agg_func), PARTIAL: df_partial}
+    tables = []
+    for table_agg_func, df_agg in df_tables.items():
+        file_name = '-'.join([measure, str(table_agg_func), *grouping_cols, *filters]) + '.parquet'
+        df_agg.to_parquet(os.path.join(directory, file_name), index=False)
+        tables.append({
+            'measure': measure,
+            'agg_func': table_agg_func,
+            'grouping_cols': grouping_cols,
+            'filters': filters,
+            'file': file_name,
+        })
+    return tables
+
+
+def _write_manifest(directory: str, source: str, tables: list[dict]) -> None:
+    """
+    Write the manifest of the rollups. For a partitioned dataset, the files they were computed from are listed too.
+    """
+    manifest = {
+        'version': ROLLUP_VERSION,
+        'source': source,
+        'source_sha256': dataset_fingerprint(source),
+        'files': select_files(None, source) if os.path.isdir(source) else [],
+        'tables': tables,
+    }
+    # The manifest is replaced atomically, since the running processes check it on every query.
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    with open(f'{manifest_path}.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+def build_rollups(source: str = PROCESSED_DATASET, directory: str = ROLLUP_DIRECTORY, engine: str = 'pandas') -> None:
+    """
+    Compute every aggregation of `ROLLUP_GROUPINGS` for every page of `PAGES`, and write them to `directory`.
+
+    Arguments:
+        source: The path of the processed dataset.
+        directory: The directory to write the rollups to.
+        engine: The engine used to compute the aggregations.
+    """
+    backend = get_backend(engine, source)
+    os.makedirs(directory, exist_ok=True)
+    tables = []
+    for measure, agg_func in _page_measures():
+        # The partial states computed so far, as (grouping columns, filters, partial states).
+        computed = []
+        for grouping_cols, filters in ROLLUP_GROUPINGS:
+            finer = next((df for cols, f, df in computed if f == filters and set(grouping_cols) < set(cols)), None)
+            if agg_func is None:
+                if finer is None:
+                    df_partial = backend.aggregate(grouping_cols=grouping_cols, measure=measure, agg_func=None, filters=filters)
+                else:
+                    df_partial = merge_partials(finer, grouping_cols, value_columns=[measure])
+            else:
+                if finer is None:
+                    df_partial = backend.aggregate_partials(grouping_cols=grouping_cols, measure=measure, filters=filters)
+                else:
+                    df_partial = merge_partials(finer, grouping_cols)
+            computed.append((grouping_cols, filters, df_partial))
+            tables.extend(_write_tables(directory, measure, agg_func, grouping_cols, filters, df_partial))
+    _write_manifest(directory, source, tables)
+
+
+def update_rollups(source: str = PROCESSED_DATASET, directory: str = ROLLUP_DIRECTORY) -> bool:
+    """
+    Merge the rows of the partition files appended since the rollups were built into their partial states, without
+    recomputing the existing rows (see `utils.update_partials`).
+
+    Arguments:
+        source: The path of the partitioned dataset.
+        directory: The directory of the rollups.
+
+    Returns:
+        Whether the rollups were updated. They cannot be if the dataset is not partitioned, or if the rollups are
+        missing, were built by another version, from another dataset or for other pages.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.isdir(source) or not os.path.isfile(manifest_path):
+        return False
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    files = select_files(None, source)
+    if (manifest.get('version') != ROLLUP_VERSION or manifest.get('source') != source or
+        not set(manifest['files']) <= set(files)):
+        return False
+    stored = {
+        rollup_key(table['measure'], table['agg_func'], table['grouping_cols'], table['filters']): table['file']
+        for table in manifest['tables']
+    }
+    # The partial states of each grouping, which are the crash counts themselves for `Crashes`.
+    partial_key = lambda measure, agg_func, grouping_cols, filters: rollup_key(
+        measure, None if agg_func is None else PARTIAL, grouping_cols, filters
+    )
+    partial_keys = [
+        partial_key(measure, agg_func, grouping_cols, filters)
+        for measure, agg_func in _page_measures() for grouping_cols, filters in ROLLUP_GROUPINGS
+    ]
+    if any(key not in stored for key in partial_keys):
+        return False
+
+    new_files = [file for file in files if file not in manifest['files']]
+    if new_files:
+        df_new = read_partitioned(source, files=new_files)
+        # Like `utils.load_dataset` does.
+        df_new['Continent'] = df_new['Continent'].fillna(value='Unknown')
+        index = FilterIndex(df_new)
+        tables = []
+        for measure, agg_func in _page_measures():
+            for grouping_cols, filters in ROLLUP_GROUPINGS:
+                df_rows = index.select(filters)
+                df_partial = pd.read_parquet(os.path.join(directory, stored[partial_key(measure, agg_func, grouping_cols, filters)]))
+                if agg_func is None:
+                    df_counts = pd.concat([df_partial, find_crash_counts(df_rows, grouping_cols)], ignore_index=True)
+                    df_partial = merge_partials(df_counts, grouping_cols, value_columns=[measure])
+                else:
+                    df_partial = update_partials(df_partial, df_rows, grouping_cols, measure)
+                tables.extend(_write_tables(directory, measure, agg_func, grouping_cols, filters, df_partial))
+        manifest['tables'] = tables
+    _write_manifest(directory, source, manifest['tables'])
+    return True
+
+
+def get_rollups(source: str = PROCESSED_DATASET, directory: str = ROLLUP_DIRECTORY) -> dict:
+    """
+    Return the rollups of the current dataset.
+
+    The fingerprint of the dataset is checked on every call, so that the rollups stop being used as soon as the
+    dataset is refreshed. They are only loaded once per dataset and manifest.
+
+    Returns:
+        A dictionary with the key returned by `rollup_key` as the key, and the aggregated dataframe as the value.
+        The dictionary is empty if the rollups are missing, were built by another version or from another dataset.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return dict()
+    return _load_rollups(directory, dataset_fingerprint(source), os.stat(manifest_path).st_mtime_ns)
+
+
+@lru_cache(maxsize=4)
+def _load_rollups(directory: str, source_fingerprint: str, manifest_mtime_ns: int) -> dict:
+    with open(os.path.join(directory, MANIFEST_FILE), 'r') as file:
+        manifest = json.load(file)
+    if manifest.get('version') != ROLLUP_VERSION or manifest.get('source_sha256') != source_fingerprint:
+        return dict()
+
+    rollups = dict()
+    for table in manifest['tables']:
+        key = rollup_key(table['measure'], table['agg_func'], table['grouping_cols'], table['filters'])
+        rollups[key] = pd.read_parquet(os.path.join(directory, table['file']))
+    return rollups
+
+
+if __name__ == '__main__':
+    if not update_rollups():
+        build_rollups()
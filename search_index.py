@@ -0,0 +1,298 @@
+"""
+A module containing an inverted index over the operators, aircraft types, registrations, flight numbers and summaries
+of the crashes, used by the search page.
+
+Every field is split into lower-case alphanumeric tokens, and each `field:token` term is mapped to the sorted row ids
+(the `Row_id` column of the processed dataset) of the crashes containing it. The sorted terms are concatenated into a
+single array of UTF-8 bytes, and the row ids of all the terms into a single array of row ids, each with an offset
+array marking where the bytes or ids of each term begin. A term or a prefix is therefore found by binary search,
+without looking at the dataset.
+
+Run `python search_index.py` to build the index after the processed dataset changes.
+
+Queries are made of terms separated by spaces:
+
+    aeroflot tupolev        crashes matching both terms
+    boeing OR airbus        crashes matching either term
+    boeing -cargo           crashes matching `boeing` but not `cargo` (`NOT cargo` works too)
+    engin*                  crashes with a token starting with `engin`
+    operator:aeroflot       `aeroflot` in the operator field only
+"""
+from functools import lru_cache
+import os
+import re
+import numpy as np
+import pandas as pd
+from dataset_store import CRASH_KEY, dataset_fingerprint
+from utils import PROCESSED_DATASET, load_dataset
+
+SEARCH_INDEX_FILE = 'Processed_dataset/search_index.npz'
+RAW_DATASET = 'Result_file_compressed.parquet'
+SEARCH_INDEX_VERSION = 2
+
+# The fields that are searched, with the column of the raw dataset they are read from, if not processed.
+SEARCH_FIELDS = {
+    'Operator': None,
+    'AC_Type': None,
+    'Registration': None,
+    'Flight_No': None,
+    'Summary': 'Summary:',
+}
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def tokenise(text: str) -> list[str]:
+    """
+    Split `text` into lower-case alphanumeric tokens.
+    """
+    if not isinstance(text, str):
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _raw_values(df: pd.DataFrame, raw_columns: list[str]) -> pd.DataFrame:
+    """
+    Read `raw_columns` of the raw dataset for the rows of `df`.
+
+    The raw rows are matched by the `CRASH_KEY` of the crashes, read like the cleaning notebook does, since their
+    positions change every time the scraper rewrites the raw dataset.
+    """
+    df_raw = pd.read_parquet(RAW_DATASET, columns=[f'{column}:' for column in CRASH_KEY] + raw_columns)
+    df_raw = df_raw.rename(columns={f'{column}:': column for column in CRASH_KEY})
+    df_raw['Date'] = pd.to_datetime(df_raw['Date']).astype(df['Date'].dtype)
+    if df_raw.duplicated(CRASH_KEY).any():
+        raise Exception(f'Some crashes of {RAW_DATASET} share their {CRASH_KEY}, so their fields cannot be matched.')
+    df_merged = df[CRASH_KEY].merge(df_raw, on=CRASH_KEY, how='left', indicator=True)
+    unmatched = df_merged['_merge'] != 'both'
+    if unmatched.any():
+        raise Exception(
+            f'{unmatched.sum()} crashes of the processed dataset are not in {RAW_DATASET}, for example '
+            f'{df_merged.loc[unmatched, CRASH_KEY].iloc[0].tolist()}.'
+        )
+    return df_merged[raw_columns]
+
+
+def _field_values(df: pd.DataFrame) -> dict:
+    """
+    Return the values of each search field, aligned with the rows of `df`.
+
+    The summaries are only present in the raw dataset, see `_raw_values`.
+    """
+    raw_columns = [raw_column for raw_column in SEARCH_FIELDS.values() if raw_column is not None]
+    df_raw = _raw_values(df, raw_columns) if raw_columns else None
+    return {
+        field: (df[field] if raw_column is None else df_raw[raw_column]).tolist()
+        for field, raw_column in SEARCH_FIELDS.items()
+    }
+
+
+def _members(row_ids: np.ndarray, postings: np.ndarray) -> np.ndarray:
+    """
+    Return whether each of the sorted `row_ids` is in the sorted `postings`, using binary search, so that the cost
+    depends on the length of `row_ids` rather than on the length of `postings`.
+    """
+    positions = np.searchsorted(postings, row_ids)
+    found = positions < len(postings)
+    found[found] = postings[positions[found]] == row_ids[found]
+    return found
+
+
+class SearchIndex:
+    """
+    An inverted index from `field:token` terms to row ids.
+
+    Attributes:
+        term_bytes: The concatenated UTF-8 bytes of the sorted terms. Since UTF-8 preserves the order of the code
+            points, the terms are sorted as bytes too.
+        term_offsets: The bytes of the `i`-th term are `term_bytes[term_offsets[i]:term_offsets[i + 1]]`.
+        offsets: The row ids of the `i`-th term are `postings[offsets[i]:offsets[i + 1]]`.
+        postings: The concatenated, sorted row ids of every term.
+        all_rows: The sorted row ids of every row, used by the clauses made of negations alone.
+    """
+
+    def __init__(
+            self,
+            term_bytes: np.ndarray,
+            term_offsets: np.ndarray,
+            offsets: np.ndarray,
+            postings: np.ndarray,
+            all_rows: np.ndarray
+        ):
+        self.term_bytes = term_bytes
+        self.term_offsets = term_offsets
+        # The binary search slices the terms out of `bytes` with Python integers, which is much faster than slicing
+        # the arrays.
+        self._term_data = term_bytes.tobytes()
+        self._term_starts = term_offsets.tolist()
+        self.offsets = offsets
+        self.postings = postings
+        self.all_rows = all_rows
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> 'SearchIndex':
+        """
+        Build the index over the rows of the processed dataset `df`.
+        """
+        postings = dict()
+        row_ids = df['Row_id'].tolist()
+        for field, values in _field_values(df).items():
+            prefix = f'{field.lower()}:'
+            for row_id, value in zip(row_ids, values):
+                for token in set(tokenise(value)):
+                    postings.setdefault(prefix + token, []).append(row_id)
+
+        terms = sorted(postings)
+        encoded_terms = [term.encode() for term in terms]
+        term_offsets = np.concatenate([[0], np.cumsum([len(term) for term in encoded_terms])]).astype(np.uint32)
+        term_bytes = np.frombuffer(b''.join(encoded_terms), dtype=np.uint8)
+        lengths = np.array([len(postings[term]) for term in terms], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.uint32)
+        flat_postings = np.empty(offsets[-1], dtype=np.uint32)
+        for i, term in enumerate(terms):
+            flat_postings[offsets[i]:offsets[i + 1]] = np.sort(postings[term])
+        return cls(term_bytes, term_offsets, offsets, flat_postings, np.sort(np.array(row_ids, dtype=np.uint32)))
+
+    def save(self, path: str, source_fingerprint: str) -> None:
+        np.savez(
+            path,
+            term_bytes=self.term_bytes,
+            term_offsets=self.term_offsets,
+            offsets=self.offsets,
+            postings=self.postings,
+            all_rows=self.all_rows,
+            version=SEARCH_INDEX_VERSION,
+            source_fingerprint=source_fingerprint
+        )
+
+    @classmethod
+    def load(cls, path: str, source_fingerprint: str) -> 'SearchIndex':
+        """
+        Load the index saved at `path`. Returns `None` if it is missing, outdated or built from another dataset.
+        """
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as arrays:
+            if arrays['version'] != SEARCH_INDEX_VERSION or arrays['source_fingerprint'] != source_fingerprint:
+                return None
+            return cls(arrays['term_bytes'], arrays['term_offsets'], arrays['offsets'], arrays['postings'], arrays['all_rows'])
+
+    def _term(self, i: int) -> bytes:
+        return self._term_data[self._term_starts[i]:self._term_starts[i + 1]]
+
+    def _bisect(self, target: bytes, right: bool) -> int:
+        """
+        Find the position of the first term greater than (or equal to, unless `right`) `target`, with binary search.
+        """
+        low, high = 0, len(self.term_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            term = self._term(middle)
+            if term < target or right and term == target:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _term_range(self, prefix: str, exact: bool) -> tuple[int, int]:
+        """
+        Find the positions of the terms equal to (or starting with) `prefix` with binary search.
+        """
+        prefix = prefix.encode()
+        # No UTF-8 byte is 0xff, so every term starting with the prefix sorts before the prefix followed by it.
+        return self._bisect(prefix, right=False), self._bisect(prefix if exact else prefix + b'\xff', right=exact)
+
+    def _lookup_token(self, fields: list[str], token: str, exact: bool) -> np.ndarray:
+        """
+        Return the sorted row ids of the rows containing `token` (or a token starting with it) in any of `fields`.
+        """
+        matches = []
+        for field in fields:
+            start, end = self._term_range(f'{field}:{token}', exact)
+            matches.extend(self.postings[self.offsets[i]:self.offsets[i + 1]] for i in range(start, end))
+        if not matches:
+            return np.empty(0, dtype=np.uint32)
+        if len(matches) == 1:
+            return matches[0]
+        return np.unique(np.concatenate(matches))
+
+    def lookup(self, term: str) -> np.ndarray:
+        """
+        Return the sorted row ids matching a single query term.
+
+        The term may be qualified by a field (`operator:aeroflot`) and may end with `*` to match a prefix. Terms such
+        as `B-737` are made of several tokens, which must all match.
+        """
+        exact = not term.endswith('*')
+        term = term.rstrip('*').lower()
+        fields = [field.lower() for field in SEARCH_FIELDS]
+        if ':' in term:
+            field, term = term.split(':', 1)
+            fields = [field]
+        tokens = tokenise(term)
+        if not tokens:
+            return np.empty(0, dtype=np.uint32)
+        result = None
+        for i, token in enumerate(tokens):
+            # Only the last token of a prefix term is a prefix.
+            matches = self._lookup_token(fields, token, exact or i < len(tokens) - 1)
+            if result is None or len(matches) < len(result):
+                result, matches = matches, result
+            if matches is not None:
+                result = result[_members(result, matches)]
+        return result
+
+    def search(self, query: str) -> np.ndarray:
+        """
+        Return the sorted row ids matching `query`. See the module docstring for the syntax.
+        """
+        result = np.empty(0, dtype=np.uint32)
+        for clause in re.split(r'\s+OR\s+', query.strip()):
+            included, excluded = [], []
+            words = clause.split()
+            negate_next = False
+            for word in words:
+                if word == 'NOT':
+                    negate_next = True
+                    continue
+                if word.startswith('-') and len(word) > 1:
+                    excluded.append(word[1:])
+                elif negate_next:
+                    excluded.append(word)
+                else:
+                    included.append(word)
+                negate_next = False
+            if not included and not excluded:
+                continue
+
+            # The intersection starts from the shortest postings, so that its cost does not depend on the number of
+            # rows. Only a clause made of negations alone starts from every row.
+            postings = sorted((self.lookup(term) for term in included), key=len)
+            matches = postings[0] if postings else self.all_rows
+            for term_postings in postings[1:]:
+                matches = matches[_members(matches, term_postings)]
+            for term in excluded:
+                matches = matches[~_members(matches, self.lookup(term))]
+            result = matches if len(result) == 0 else np.union1d(result, matches)
+        return result
+
+
+def build_search_index(source: str = PROCESSED_DATASET, path: str = SEARCH_INDEX_FILE) -> SearchIndex:
+    """
+    Build the search index of the processed dataset, and save it next to it.
+    """
+    index = SearchIndex.build(load_dataset(source))
+    index.save(path, dataset_fingerprint(source))
+    return index
+
+
+@lru_cache(maxsize=None)
+def get_search_index(source: str = PROCESSED_DATASET, path: str = SEARCH_INDEX_FILE) -> SearchIndex:
+    """
+    Load the search index once per process. Returns `None` if it has not been built for the current dataset.
+    """
+    return SearchIndex.load(path, dataset_fingerprint(source))
+
+
+if __name__ == '__main__':
+    build_search_index()
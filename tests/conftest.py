@@ -0,0 +1,41 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules of the app live at the root of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import CATEGORY_ORDERS
+
+
+@pytest.fixture
+def crashes() -> pd.DataFrame:
+    """
+    A small dataset with the columns of the processed dataset that the filters and aggregations use.
+    """
+    rng = np.random.default_rng(0)
+    n = 500
+    dates = pd.Timestamp('1950-01-01') + pd.to_timedelta(rng.integers(0, 70 * 365, n), unit='D')
+    fatalities = rng.integers(0, 300, n).astype('float64')
+    fatalities[rng.random(n) < 0.1] = np.nan
+    df = pd.DataFrame({
+        'Date': dates,
+        'Time': np.where(rng.random(n) < 0.3, None, [f'{hour:02d}{minute:02d}' for hour, minute in zip(rng.integers(0, 24, n), rng.integers(0, 60, n))]),
+        'Country': rng.choice(['Nepal', 'India', 'Brazil', 'Canada', 'United States of America'], n),
+        'Continent': rng.choice(['Asia', 'South America', 'North America'], n),
+        'Operator': rng.choice(['Aeroflot', 'Air India', 'Varig'], n),
+        'AC_Type': rng.choice(['Boeing 737', 'Airbus A320', 'Tupolev 154'], n),
+        'Type': rng.choice(['Passenger', 'Military'], n),
+        'Month': pd.Categorical(dates.strftime('%B'), categories=CATEGORY_ORDERS['Month'], ordered=True),
+        'Day_of_week': pd.Categorical(dates.strftime('%A'), categories=CATEGORY_ORDERS['Day_of_week'], ordered=True),
+        'Decade': dates.year // 10 * 10,
+        'Total_fatalities': fatalities,
+    })
+    df['Survival_rate'] = np.where(np.isnan(fatalities), np.nan, rng.random(n))
+    df['US_State'] = np.where(df['Country'] == 'United States of America', rng.choice(['Texas', 'Alaska'], n), None)
+    df['Registration'] = [f'REG-{i}' for i in range(n)]
+    df['Row_id'] = np.arange(n, dtype=np.int64)
+    # The processed dataset is sorted by date in descending order.
+    return df.sort_values(by='Date', ascending=False, ignore_index=True)
@@ -0,0 +1,51 @@
+import pandas as pd
+from aggregation_cache import AggregationCache
+
+
+def _aggregation(value: int) -> pd.DataFrame:
+    return pd.DataFrame({'Year': [2000, 2001], 'Crashes': [value, value]})
+
+
+def _cache(entries: int) -> AggregationCache:
+    size = int(_aggregation(0).memory_usage(index=True, deep=True).sum())
+    return AggregationCache(max_bytes=entries * size)
+
+
+def test_put_evicts_the_least_recently_used():
+    cache = _cache(2)
+    cache.put('a', _aggregation(1))
+    cache.put('b', _aggregation(2))
+    cache.get('a')
+    cache.put('c', _aggregation(3))
+    assert 'a' in cache and 'b' not in cache and 'c' in cache
+
+
+def test_prefetched_put_never_evicts_a_requested_aggregation():
+    cache = _cache(2)
+    cache.put('a', _aggregation(1))
+    cache.put('b', _aggregation(2), prefetched=True)
+    # The prefetched aggregation only evicts the other prefetched ones.
+    cache.put('c', _aggregation(3), prefetched=True)
+    assert 'a' in cache and 'b' not in cache and 'c' in cache
+
+
+def test_prefetched_put_is_dropped_when_only_requested_aggregations_remain():
+    cache = _cache(2)
+    cache.put('a', _aggregation(1))
+    cache.put('b', _aggregation(2))
+    cache.put('c', _aggregation(3), prefetched=True)
+    assert 'a' in cache and 'b' in cache and 'c' not in cache
+    # A prefetched copy of a requested aggregation leaves it as it is, so that it cannot be evicted by a prefetch.
+    cache.put('a', _aggregation(4), prefetched=True)
+    cache.put('d', _aggregation(5), prefetched=True)
+    assert cache.get('a')['Crashes'].tolist() == [1, 1] and 'd' not in cache
+
+
+def test_get_turns_a_prefetched_aggregation_into_a_requested_one():
+    cache = _cache(2)
+    cache.put('a', _aggregation(1), prefetched=True)
+    cache.put('b', _aggregation(2), prefetched=True)
+    assert cache.get('a') is not None
+    cache.put('c', _aggregation(3), prefetched=True)
+    cache.put('d', _aggregation(4), prefetched=True)
+    assert 'a' in cache and 'b' not in cache
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+from dataset_store import append_rows, partitioned_is_stale, read_partitioned, refresh_partitioned, select_files, write_partitioned
+
+
+@pytest.fixture
+def stored(crashes, tmp_path) -> tuple[pd.DataFrame, str]:
+    df = crashes.drop(columns=['Month', 'Day_of_week'])
+    df.loc[df.index[::7], 'Continent'] = None
+    root = str(tmp_path / 'Crash_data')
+    write_partitioned(df, root)
+    return df, root
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'Decade': (1960, 1980)},
+    {'Decade': (1975, 1975)},
+    {'Decade': (1965, 1994), 'Year': (1972, 2001)},
+    {'Year': (1975, 1983), 'Country': ['Nepal']},
+    {'Continent': ['Unknown']},
+    {'Continent': ['Unknown', 'Asia'], 'Decade': (1990, 2000)},
+])
+def test_read_partitioned_matches_the_loaded_dataset(stored, filters):
+    df, root = stored
+    expected = df.assign(Continent=df['Continent'].fillna('Unknown'))
+    mask = pd.Series(True, index=expected.index)
+    for column, selection in filters.items():
+        if column == 'Year':
+            mask &= expected['Date'].dt.year.between(*selection)
+        elif column == 'Decade':
+            mask &= expected['Decade'].between(*selection)
+        else:
+            mask &= expected[column].isin(selection)
+    assert sorted(read_partitioned(root, filters=filters)['Row_id']) == sorted(expected.loc[mask, 'Row_id'])
+
+
+def test_select_files_skips_other_decades(stored):
+    _, root = stored
+    assert all('Decade=1970' in path for path in select_files({'Decade': (1970, 1970)}, root))
+
+
+def test_append_rows_numbers_the_new_rows(stored):
+    df, root = stored
+    df_new = df.iloc[:3].drop(columns='Row_id')
+    append_rows(df_new, root)
+    row_ids = read_partitioned(root)['Row_id']
+    assert len(row_ids) == len(df) + 3
+    assert row_ids.is_unique and row_ids.max() == len(df) + 2
+
+
+def test_refresh_partitioned_appends_only_the_new_rows(crashes, tmp_path):
+    source, root = str(tmp_path / 'Crash_data_new.parquet'), str(tmp_path / 'Crash_data')
+    df = crashes.drop(columns=['Row_id', 'Month', 'Day_of_week'])
+    df.iloc[:400].to_parquet(source)
+    refresh_partitioned(source, root)
+    assert not partitioned_is_stale(source, root)
+
+    # The notebook rewrites the whole file, with the new rows first.
+    df.iloc[::-1].to_parquet(source)
+    assert partitioned_is_stale(source, root)
+    refresh_partitioned(source, root)
+    assert not partitioned_is_stale(source, root)
+    df_stored = read_partitioned(root)
+    assert len(df_stored) == len(df) and df_stored['Row_id'].is_unique
+    assert refresh_partitioned(source, root) == []
+
+    # A crash whose values were changed by the cleaning is neither appended again nor silently kept.
+    df_changed = df.copy()
+    df_changed.loc[df.index[10], 'Country'] = 'Atlantis'
+    df_changed.to_parquet(source)
+    with pytest.raises(Exception, match='1 crashes'):
+        refresh_partitioned(source, root)
+    assert len(read_partitioned(root)) == len(df)
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from filters import FilterIndex, parse_filters, narrow_filters
+
+
+def naive_select(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    """
+    Apply `filters` with a boolean mask over the whole dataset.
+    """
+    mask = pd.Series(True, index=df.index)
+    for column, selection in filters.items():
+        if column == 'Year':
+            mask &= df['Date'].dt.year.between(*selection)
+        elif column == 'Decade':
+            mask &= df['Decade'].between(*selection)
+        elif column == 'Day':
+            mask &= df['Date'].dt.day.isin(selection)
+        else:
+            mask &= df[column].isin(selection)
+    return df[mask]
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'Year': (1960, 1975)},
+    {'Decade': (1970, 1990)},
+    {'Decade': (1975, 1975)},
+    {'Decade': (1965, 1994)},
+    {'Year': (1965, 2001), 'Decade': (1980, 2010)},
+    {'Year': (1990, 1990)},
+    {'Country': ['Nepal', 'Brazil']},
+    {'Continent': ['Asia'], 'Month': ['January', 'July'], 'Day_of_week': ['Sunday']},
+    {'Day': [1, 15, 31], 'Type': ['Passenger']},
+    {'Decade': (1950, 1960), 'Operator': ['Aeroflot'], 'AC_Type': ['Boeing 737', 'Tupolev 154']},
+    {'Country': ['Atlantis']},
+    {'Country': []},
+    {'Year': (2100, 2200)},
+    {'Row_id': [3, 14, 159, 265, 358]},
+])
+def test_select_matches_a_naive_mask(crashes, filters):
+    expected = naive_select(crashes, filters)
+    selected = FilterIndex(crashes).select(filters)
+    assert sorted(selected['Row_id']) == sorted(expected['Row_id'])
+    # The rows are returned in date order.
+    assert selected['Date'].is_monotonic_increasing
+
+
+def test_date_slice_covers_the_selected_years(crashes):
+    index = FilterIndex(crashes)
+    rows = index.df.iloc[index.date_slice({'Year': (1970, 1979)})]
+    assert rows['Date'].dt.year.between(1970, 1979).all()
+    assert len(rows) == crashes['Date'].dt.year.between(1970, 1979).sum()
+
+
+def test_options(crashes):
+    index = FilterIndex(crashes)
+    assert index.options('Country') == sorted(crashes['Country'].unique())
+    assert index.options('Decade') == sorted(crashes['Decade'].unique())
+
+
+def test_parse_filters():
+    assert parse_filters({'Year': [1990, 2000], 'Country': ['Nepal']}) == {'Year': (1990, 2000), 'Country': ['Nepal']}
+    with pytest.raises(Exception):
+        parse_filters({'Year': [1990]})
+    with pytest.raises(Exception):
+        parse_filters({'Summary': ['fire']})
+
+
+def test_narrow_filters_intersects_the_selections():
+    filters = {'Country': ['Nepal', 'India']}
+    assert narrow_filters(filters, 'Country', ['India', 'Brazil']) == {'Country': ['India']}
+    assert narrow_filters({}, 'Country', ['India']) == {'Country': ['India']}
+    assert filters == {'Country': ['Nepal', 'India']}
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils import MERGEABLE_AGG_FUNCS, aggregate_columns, finalise_partials, merge_partials, partial_aggregate, prune_nodes, partial_fold_funcs, update_partials
+
+
+def _assert_same_values(df_actual: pd.DataFrame, df_expected: pd.DataFrame, grouping_cols: list[str], value_column: str):
+    df_actual = df_actual.sort_values(by=grouping_cols, ignore_index=True)
+    df_expected = df_expected.sort_values(by=grouping_cols, ignore_index=True)
+    assert df_actual[grouping_cols].astype(str).equals(df_expected[grouping_cols].astype(str))
+    np.testing.assert_allclose(
+        df_actual[value_column].to_numpy(dtype=float), df_expected[value_column].to_numpy(dtype=float), equal_nan=True
+    )
+
+
+@pytest.mark.parametrize('agg_func', MERGEABLE_AGG_FUNCS)
+def test_finalised_partials_match_groupby(crashes, agg_func):
+    df_partial = partial_aggregate(crashes, ['Decade'], 'Total_fatalities')
+    df_expected = crashes.groupby('Decade')['Total_fatalities'].agg(agg_func).reset_index()
+    _assert_same_values(finalise_partials(df_partial, 'Total_fatalities', agg_func), df_expected, ['Decade'], 'Total_fatalities')
+
+
+@pytest.mark.parametrize('agg_func', MERGEABLE_AGG_FUNCS)
+def test_merged_partials_match_groupby(crashes, agg_func):
+    # The partial states of the finer grouping are merged into the coarser one.
+    df_partial = merge_partials(partial_aggregate(crashes, ['Country', 'Month'], 'Total_fatalities'), ['Country'])
+    df_expected = crashes.groupby('Country')['Total_fatalities'].agg(agg_func).reset_index()
+    _assert_same_values(finalise_partials(df_partial, 'Total_fatalities', agg_func), df_expected, ['Country'], 'Total_fatalities')
+
+
+def test_partials_of_split_rows_merge_into_the_partials_of_all_rows(crashes):
+    first, second = crashes.iloc[:200], crashes.iloc[200:]
+    df_merged = merge_partials(pd.concat([
+        partial_aggregate(first, ['Country'], 'Total_fatalities'),
+        partial_aggregate(second, ['Country'], 'Total_fatalities'),
+    ], ignore_index=True), ['Country'])
+    df_expected = crashes.groupby('Country')['Total_fatalities'].mean().reset_index()
+    _assert_same_values(finalise_partials(df_merged, 'Total_fatalities', 'mean'), df_expected, ['Country'], 'Total_fatalities')
+
+
+def test_aggregate_columns_derives_the_year(crashes):
+    df_agg = aggregate_columns(crashes, ['Year'], 'sum', 'Total_fatalities')
+    df_expected = crashes.groupby(crashes['Date'].dt.year.rename('Year'))['Total_fatalities'].sum().reset_index()
+    _assert_same_values(df_agg, df_expected, ['Year'], 'Total_fatalities')
+
+
+def test_finalise_partials_rejects_other_functions(crashes):
+    df_partial = partial_aggregate(crashes, ['Decade'], 'Total_fatalities')
+    with pytest.raises(AttributeError):
+        finalise_partials(df_partial, 'Total_fatalities', 'median')
+
+
+def test_prune_nodes_folds_the_smallest_rows():
+    df = pd.DataFrame({'Country': list('abcde'), 'Crashes': [50, 40, 5, 3, 2]})
+    df_pruned = prune_nodes(df, value_column='Crashes', label_column='Country', top_k=2)
+    assert df_pruned.set_index('Country')['Crashes'].to_dict() == {'a': 50, 'b': 40, 'Other': 10}
+
+
+def test_prune_nodes_folds_partial_states(crashes):
+    df_partial = partial_aggregate(crashes, ['Country'], 'Total_fatalities')
+    df_partial['Total_fatalities'] = finalise_partials(df_partial, 'Total_fatalities', 'mean')['Total_fatalities']
+    df_pruned = prune_nodes(
+        df_partial, value_column='Total_fatalities', label_column='Country', top_k=2,
+        fold_funcs=partial_fold_funcs('Total_fatalities')
+    )
+    df_final = finalise_partials(df_pruned.drop(columns='Total_fatalities'), 'Total_fatalities', 'mean')
+    kept = df_final.loc[df_final['Country'] != 'Other', 'Country']
+    expected = crashes.loc[~crashes['Country'].isin(kept), 'Total_fatalities'].mean()
+    assert df_final.loc[df_final['Country'] == 'Other', 'Total_fatalities'].item() == pytest.approx(expected)
+
+
+def test_update_partials_matches_the_partials_of_all_rows(crashes):
+    first, second = crashes.iloc[:300], crashes.iloc[300:]
+    df_updated = update_partials(partial_aggregate(first, ['Country', 'Month'], 'Total_fatalities'), second, ['Country', 'Month'], 'Total_fatalities')
+    df_expected = partial_aggregate(crashes, ['Country', 'Month'], 'Total_fatalities')
+    pd.testing.assert_frame_equal(df_updated, df_expected, check_dtype=False, check_categorical=False)
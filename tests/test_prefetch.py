@@ -0,0 +1,37 @@
+import threading
+from prefetch import Prefetcher
+
+
+def test_cancel_stops_only_the_tasks_of_its_session():
+    prefetcher = Prefetcher('pandas', max_workers=1)
+    started, release = threading.Event(), threading.Event()
+    completed = []
+
+    def task(session_id: str, generation: int, name: str):
+        started.set()
+        release.wait(timeout=5)
+        # A task stops as soon as its session has been cancelled, like `Prefetcher._prefetch_state`.
+        if prefetcher._is_current(session_id, generation):
+            completed.append(name)
+
+    generation_a = prefetcher.cancel('a')
+    prefetcher._submit('a', generation_a, task, 'a-running')
+    started.wait(timeout=5)
+    prefetcher._submit('a', generation_a, task, 'a-pending')
+    generation_b = prefetcher.cancel('b')
+    prefetcher._submit('b', generation_b, task, 'b-pending')
+
+    # The rerun of session `a` cancels its pending task, and stops its running one.
+    prefetcher.cancel('a')
+    release.set()
+    prefetcher.executor.shutdown(wait=True)
+    assert completed == ['b-pending']
+
+
+def test_a_cancelled_session_submits_nothing():
+    prefetcher = Prefetcher('pandas', max_workers=1)
+    generation = prefetcher.cancel('a')
+    prefetcher.cancel('a')
+    prefetcher._submit('a', generation, lambda session_id, generation: None)
+    assert 'a' not in prefetcher._futures
+    prefetcher.executor.shutdown(wait=True)
@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+from backends import DuckDBBackend, duckdb
+from query_api import query, options
+
+INJECTED_COLUMN = 'Decade", (SELECT 42) AS "leak'
+
+
+@pytest.mark.parametrize('arguments', [
+    dict(grouping_cols=[INJECTED_COLUMN]),
+    dict(grouping_cols=['Year'], measure=INJECTED_COLUMN, agg_func='sum'),
+    dict(grouping_cols=['Year'], measure='Total_fatalities', agg_func='sum) FROM secrets --'),
+    dict(grouping_cols=['Year'], filters={INJECTED_COLUMN: ['x']}),
+    dict(grouping_cols=['Year'], measure='Total_fatalities'),
+    dict(grouping_cols=['Year'], measure='Crashes', agg_func='sum'),
+])
+def test_query_rejects_unknown_columns_and_functions(arguments):
+    with pytest.raises(Exception, match='must be one of|aggregation function'):
+        query(engine='duckdb', use_rollups=False, **arguments)
+
+
+def test_options_rejects_unknown_columns():
+    with pytest.raises(Exception, match='must be one of'):
+        options(INJECTED_COLUMN, engine='duckdb')
+
+
+@pytest.mark.skipif(duckdb is None, reason='duckdb is not installed')
+def test_duckdb_quotes_identifiers(crashes, tmp_path):
+    path = str(tmp_path / 'crashes.parquet')
+    crashes.to_parquet(path)
+    backend = DuckDBBackend(path)
+    # The quotes of a column name cannot end the quoted identifier: the column is simply unknown.
+    with pytest.raises(Exception, match='The column name is invalid.'):
+        backend.aggregate(grouping_cols=[INJECTED_COLUMN], measure='Crashes', agg_func=None, filters=dict())
+    with pytest.raises(Exception, match='The column name is invalid.'):
+        backend.aggregate(grouping_cols=['Decade'], measure=INJECTED_COLUMN, agg_func='sum', filters=dict())
+
+    df_agg = backend.aggregate(grouping_cols=['Decade'], measure='Total_fatalities', agg_func='sum', filters=dict())
+    expected = crashes.groupby('Decade')['Total_fatalities'].sum()
+    pd.testing.assert_series_equal(df_agg.set_index('Decade')['Total_fatalities'], expected, check_dtype=False, check_index_type=False)
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+from backends import PandasBackend
+from dataset_store import append_rows, write_partitioned
+from rollups import PARTIAL, build_rollups, get_rollups, update_rollups
+
+
+@pytest.fixture
+def rollups(crashes, tmp_path) -> tuple[str, str]:
+    source, directory = str(tmp_path / 'Crash_data_new.parquet'), str(tmp_path / 'rollups')
+    crashes.drop(columns='Row_id').to_parquet(source)
+    build_rollups(source, directory, engine='pandas')
+    return source, directory
+
+
+def _assert_rollups_match_the_engine(source: str, directory: str):
+    backend = PandasBackend(source)
+    tables = get_rollups(source, directory)
+    assert len(tables) > 0
+    for (measure, agg_func, grouping_cols, filters), df_rollup in tables.items():
+        grouping_cols, filters = list(grouping_cols), {column: list(selection) for column, selection in filters}
+        if agg_func == PARTIAL:
+            expected = backend.aggregate_partials(grouping_cols=grouping_cols, measure=measure, filters=filters)
+        else:
+            expected = backend.aggregate(grouping_cols=grouping_cols, measure=measure, agg_func=agg_func, filters=filters)
+        pd.testing.assert_frame_equal(
+            df_rollup.reset_index(drop=True), expected.reset_index(drop=True),
+            check_dtype=False, check_categorical=False, check_exact=False
+        )
+
+
+def test_rollups_match_the_engine(rollups):
+    _assert_rollups_match_the_engine(*rollups)
+
+
+def test_update_rollups_merges_the_appended_rows(crashes, tmp_path):
+    source, directory = str(tmp_path / 'Crash_data'), str(tmp_path / 'rollups')
+    df = crashes.drop(columns='Row_id')
+    write_partitioned(df.iloc[:300], source)
+    build_rollups(source, directory, engine='pandas')
+    append_rows(df.iloc[300:], source)
+    assert get_rollups(source, directory) == dict()
+    assert update_rollups(source, directory)
+    _assert_rollups_match_the_engine(source, directory)
+    # Nothing was appended since.
+    assert update_rollups(source, directory)
+    _assert_rollups_match_the_engine(source, directory)
+
+
+def test_update_rollups_needs_a_partitioned_dataset(rollups):
+    assert not update_rollups(*rollups)
+
+
+def test_rollups_are_ignored_once_the_dataset_changes(crashes, rollups):
+    source, directory = rollups
+    assert get_rollups(source, directory)
+    crashes.drop(columns='Row_id').iloc[1:].to_parquet(source)
+    assert get_rollups(source, directory) == dict()
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+import search_index
+from search_index import SearchIndex, tokenise
+
+ROWS = pd.DataFrame({
+    'Row_id': [0, 1, 2, 3, 4, 5],
+    'Operator': ['Aeroflot', 'Air India', 'Aeroflot Cargo', 'Varig', 'Air France', None],
+    'AC_Type': ['Tupolev Tu-154', 'Boeing 737', 'Antonov An-12', 'Boeing 707', 'Airbus A330', 'Boeing 747'],
+})
+
+
+@pytest.fixture
+def index(monkeypatch) -> SearchIndex:
+    # The summaries are read from the raw dataset, so only the fields of the processed dataset are indexed here.
+    monkeypatch.setattr(search_index, 'SEARCH_FIELDS', {'Operator': None, 'AC_Type': None})
+    return SearchIndex.build(ROWS)
+
+
+def test_tokenise():
+    assert tokenise('Tupolev Tu-154') == ['tupolev', 'tu', '154']
+    assert tokenise(None) == []
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('aeroflot', [0, 2]),
+    ('AEROFLOT', [0, 2]),
+    ('aeroflot tupolev', [0]),
+    ('boeing OR tupolev', [0, 1, 3, 5]),
+    ('boeing -air', [3, 5]),
+    ('boeing NOT air', [3, 5]),
+    ('-boeing', [0, 2, 4]),
+    ('boe*', [1, 3, 5]),
+    ('a*', [0, 1, 2, 4]),
+    ('operator:air', [1, 4]),
+    ('ac_type:air*', [4]),
+    ('tu-154', [0]),
+    ('boeing 7*', [1, 3, 5]),
+    ('concorde', []),
+    ('', []),
+    ('aeroflot OR -boeing', [0, 2, 4]),
+])
+def test_search(index, query, expected):
+    assert index.search(query).tolist() == expected
+
+
+def test_save_and_load(index, tmp_path):
+    path = str(tmp_path / 'index.npz')
+    index.save(path, 'fingerprint')
+    loaded = SearchIndex.load(path, 'fingerprint')
+    assert loaded.search('boeing -air').tolist() == [3, 5]
+    # An index built from another dataset is not used.
+    assert SearchIndex.load(path, 'other') is None
+
+
+def test_summaries_follow_the_crashes_once_the_raw_dataset_is_rewritten(tmp_path, monkeypatch):
+    raw_path = str(tmp_path / 'Result_file_compressed.parquet')
+    monkeypatch.setattr(search_index, 'RAW_DATASET', raw_path)
+    monkeypatch.setattr(search_index, 'SEARCH_FIELDS', {'Operator': None, 'Summary': 'Summary:'})
+    crashes = pd.DataFrame({
+        'Date': pd.to_datetime(['2023-01-15', '2022-11-21', '2022-11-21']),
+        'Operator': ['Yeti Airlines', 'AeroPaca SAS', 'Aeroflot'],
+        'Registration': ['9NANC', 'HK-5121', 'RA-123'],
+        'Summary': ['Stalled on approach', 'Ran out of fuel', 'Engine fire'],
+        'Row_id': [0, 1, 2],
+    })
+    # The scraper rewrites the raw dataset with the latest crash first, which the dataset appends with the next id.
+    new_crash = pd.DataFrame({
+        'Date': pd.to_datetime(['2024-01-02']), 'Operator': ['Japan Coast Guard'], 'Registration': ['JA722A'],
+        'Summary': ['Collided on the runway'], 'Row_id': [3],
+    })
+    crashes = pd.concat([crashes, new_crash], ignore_index=True)
+    raw = pd.concat([new_crash, crashes.iloc[:3]], ignore_index=True)
+    pd.DataFrame({
+        'Date:': raw['Date'].dt.strftime('%B %d, %Y'),
+        'Operator:': raw['Operator'],
+        'Registration:': raw['Registration'],
+        'Summary:': raw['Summary'],
+    }).to_parquet(raw_path)
+
+    index = SearchIndex.build(crashes.drop(columns='Summary'))
+    assert index.search('summary:runway').tolist() == [3]
+    assert index.search('summary:fuel').tolist() == [1]
+
+    # A crash missing from the raw dataset cannot be indexed.
+    missing = crashes.assign(Registration=crashes['Registration'].replace('RA-123', 'RA-999'))
+    with pytest.raises(Exception, match='1 crashes'):
+        SearchIndex.build(missing.drop(columns='Summary'))
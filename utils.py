@@ -1,10 +1,100 @@
 """
 A bunch of utlity functions for aggregation, pivot tables, etc.
 """
+import os
+import warnings
+import numpy as np
 import pandas as pd
+from dataset_store import PARTITIONED_DATASET, MONOLITHIC_DATASET, ARROW_DATASET, read_partitioned, read_arrow, write_arrow, dataset_fingerprint, partitioned_is_stale
+
+# The partitioned dataset is used when it has been created, see `dataset_store.py`.
+PROCESSED_DATASET = PARTITIONED_DATASET if os.path.isdir(PARTITIONED_DATASET) else MONOLITHIC_DATASET
+if PROCESSED_DATASET == PARTITIONED_DATASET and partitioned_is_stale():
+    warnings.warn(
+        f'{MONOLITHIC_DATASET} has changed since {PARTITIONED_DATASET} was last refreshed from it, so its new rows are '
+        'not shown. Run `python dataset_store.py` to append them.'
+    )
+
+# Grouping columns which are not stored in the dataset, but derived from the `Date` column.
+DERIVED_COLUMNS = {
+    'Year': lambda df: df['Date'].dt.year.rename('Year'),
+    'Day': lambda df: df['Date'].dt.day.rename('Day'),
+}
+
+# The partial states of an aggregation, with the function that merges them.
+PARTIAL_STATES = {
+    'sum': 'sum',
+    'count': 'sum',
+    'sumsq': 'sum',
+    'min': 'min',
+    'max': 'max',
+}
+
+# The aggregation functions which can be computed from the partial states.
+MERGEABLE_AGG_FUNCS = ['sum', 'count', 'mean', 'min', 'max', 'var', 'std']
+
+# The aggregation functions whose values can be added up, `None` being the crash counts.
+ADDITIVE_AGG_FUNCS = [None, 'sum', 'count']
+
+# The order of the categorical columns, used to restore them in results computed outside of pandas.
+CATEGORY_ORDERS = {
+    'Month': ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+              'November', 'December'],
+    'Day_of_week': ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday'],
+}
+
+
+def load_dataset(path: str = PROCESSED_DATASET, use_arrow: bool = True) -> pd.DataFrame:
+    """
+    Load the processed dataset, with the missing continents replaced by `Unknown`.
+    
+    Every row has a stable `Row_id`, which is used by the search index.
+    
+    Arguments:
+        path: The path of either the Parquet file or the partitioned dataset.
+        use_arrow: Whether to memory-map the Arrow file of `build_arrow_dataset` instead, if it is up to date. Its 
+            rows are sorted by date in ascending order.
+    """
+    if use_arrow and os.path.isfile(ARROW_DATASET):
+        df = read_arrow(dataset_fingerprint(path))
+        if df is not None:
+            return df
+    df = read_partitioned(path) if os.path.isdir(path) else pd.read_parquet(path)
+    df['Continent'] = df['Continent'].fillna(value='Unknown')
+    # The rows of the Parquet file are identified by their position.
+    if 'Row_id' not in df.columns:
+        df['Row_id'] = np.arange(len(df), dtype=np.int64)
+    return df
+
+
+def build_arrow_dataset(source: str = PROCESSED_DATASET, path: str = ARROW_DATASET) -> None:
+    """
+    Convert the processed dataset into the Arrow file memory-mapped by `load_dataset`.
+
+    The rows are stored in the order of `FilterIndex`, so that it can use the mapped columns as they are.
+    """
+    df = load_dataset(source, use_arrow=False).sort_values(by='Date', kind='stable', ignore_index=True)
+    write_arrow(df, dataset_fingerprint(source), path)
+
+
+def resolve_grouping_cols(df: pd.DataFrame, grouping_cols: list[str]) -> list:
+    """
+    Replace the names of the derived columns in `grouping_cols` by the corresponding series of `df`.
+    
+    Arguments:
+        df: The dataframe to be operated upon.
+        grouping_cols: A column name, a pandas Series or a list of either.
+    Returns:
+        A list that can be passed to `DataFrame.groupby`.
+    """
+    if not isinstance(grouping_cols, list):
+        grouping_cols = [grouping_cols]
+    return [
+        DERIVED_COLUMNS[column](df) if isinstance(column, str) and column not in df.columns and column in DERIVED_COLUMNS
+        else column
+        for column in grouping_cols
+    ]
 
-# Load the dataframe.
-df = pd.read_parquet('Processed_dataset/Crash_data_new.parquet')
 
 def find_crash_counts(
         df: pd.DataFrame, 
@@ -17,7 +107,7 @@ def find_crash_counts(
     
     Arguments:
         df: The dataframe to be operated upon.
-        grouping_cols: The columns to aggregate on.
+        grouping_cols: The columns to aggregate on. `Year` and `Day` are derived from the `Date` column.
         date_name: If the data is to be aggregated from a date value, supply the name of the new column.
         sort_ascending: Whether to sort the values. `None` doesn't sort the values at all, `True` sorts in ascending 
             order and `False` sorts in descending order.
@@ -25,7 +115,7 @@ def find_crash_counts(
         A pandas DataFrame containing the aggregated data.
     """
     try:
-        df_grouped = df.groupby(grouping_cols) \
+        df_grouped = df.groupby(resolve_grouping_cols(df, grouping_cols)) \
             .size() \
             .reset_index(name='Crashes')
     except KeyError:
@@ -48,9 +138,11 @@ def aggregate_columns(
     """
     Aggregates `column_names` by the aggregation function `agg_func`.
     
+    The aggregation functions in `MERGEABLE_AGG_FUNCS` are computed from the partial states of `partial_aggregate`.
+    
     Arguments:
         df: The dataframe to be ooperated upon.
-        column_name: The columns that is to be aggregated by.
+        column_name: The columns that is to be aggregated by. `Year` and `Day` are derived from the `Date` column.
         value_column: The column containing the values to be aggregated.
         agg_func: The aggregation function to be applied to `column_name`.
         date_name: If a date column is supplied, rename that column to `date_name`.
@@ -59,10 +151,13 @@ def aggregate_columns(
         A pandas DataFrame containing the aggregated data.
     """
     try:
-        df_grouped = df.groupby(column_names) \
-            [value_column] \
-            .agg(agg_func) \
-            .reset_index()
+        if agg_func in MERGEABLE_AGG_FUNCS:
+            df_grouped = finalise_partials(partial_aggregate(df, column_names, value_column), value_column, agg_func)
+        else:
+            df_grouped = df.groupby(resolve_grouping_cols(df, column_names)) \
+                [value_column] \
+                .agg(agg_func) \
+                .reset_index()
     except AttributeError:
         raise Exception('The aggregation function is not correct!')
     except KeyError:
@@ -71,4 +166,183 @@ def aggregate_columns(
     if date_name is not None:
         df_grouped = df_grouped.rename(columns={'Date': date_name})
         
-    return df_grouped
\ No newline at end of file
+    return df_grouped
+
+
+def _partial_columns(value_column: str) -> dict:
+    """
+    Return the names of the partial state columns of `value_column`, with the state as the key.
+    """
+    return {state: f'{value_column}_{state}' for state in PARTIAL_STATES}
+
+
+def partial_fold_funcs(value_column: str) -> dict:
+    """
+    Return the functions merging the partial state columns of `value_column`, as expected by `prune_nodes`.
+    """
+    return {column: PARTIAL_STATES[state] for state, column in _partial_columns(value_column).items()}
+
+
+def partial_aggregate(
+        df: pd.DataFrame,
+        grouping_cols: list[str],
+        value_column: str
+    ) -> pd.DataFrame:
+    """
+    Aggregates `value_column` by `grouping_cols` into partial states, which can be merged with each other.
+    
+    The states are the sum, the count of non-missing values, the sum of squares, the minimum and the maximum. They are
+    stored in the columns `<value_column>_<state>`.
+    
+    Arguments:
+        df: The dataframe to be operated upon.
+        grouping_cols: The columns to aggregate on. `Year` and `Day` are derived from the `Date` column.
+        value_column: The column containing the values to be aggregated.
+    Returns:
+        A pandas DataFrame containing the grouping columns and the partial states.
+    """
+    columns = _partial_columns(value_column)
+    keys = [df[column] if isinstance(column, str) else column for column in resolve_grouping_cols(df, grouping_cols)]
+    values = df[value_column].astype('float64')
+    df_partial = pd.DataFrame({
+            columns['sum']: values,
+            columns['count']: values.notna().astype('int64'),
+            columns['sumsq']: values ** 2,
+            columns['min']: values,
+            columns['max']: values,
+        }) \
+        .groupby(keys) \
+        .agg({column: PARTIAL_STATES[state] for state, column in columns.items()}) \
+        .reset_index()
+    if pd.api.types.is_integer_dtype(df[value_column]):
+        df_partial[columns['sum']] = df_partial[columns['sum']].astype('int64')
+    return df_partial
+
+
+def merge_partials(df_partial: pd.DataFrame, grouping_cols: list[str], value_columns: list[str] = None) -> pd.DataFrame:
+    """
+    Merges partial states into the coarser grouping `grouping_cols`, which must be a subset of their grouping columns.
+    
+    For example, the states grouped by year and month can be merged into the states grouped by month.
+    
+    Arguments:
+        df_partial: The partial states, as returned by `partial_aggregate` or `find_crash_counts`.
+        grouping_cols: The columns to aggregate on.
+        value_columns: The columns to be merged. By default, the columns of the partial states. Other columns, like
+            the crash counts of `find_crash_counts`, are summed.
+    Returns:
+        A pandas DataFrame containing the merged partial states.
+    """
+    if not isinstance(grouping_cols, list):
+        grouping_cols = [grouping_cols]
+    if value_columns is None:
+        value_columns = [column for column in df_partial.columns if column.rsplit('_', 1)[-1] in PARTIAL_STATES]
+    merge_funcs = {column: PARTIAL_STATES.get(column.rsplit('_', 1)[-1], 'sum') for column in value_columns}
+    return df_partial.groupby(grouping_cols).agg(merge_funcs).reset_index()
+
+
+def update_partials(
+        df_partial: pd.DataFrame,
+        df_new: pd.DataFrame,
+        grouping_cols: list[str],
+        value_column: str
+    ) -> pd.DataFrame:
+    """
+    Adds the rows of `df_new` to the partial states `df_partial`, without recomputing the existing rows.
+    """
+    df_new_partial = partial_aggregate(df_new, grouping_cols, value_column)
+    return merge_partials(pd.concat([df_partial, df_new_partial], ignore_index=True), grouping_cols)
+
+
+def finalise_partials(df_partial: pd.DataFrame, value_column: str, agg_func: str) -> pd.DataFrame:
+    """
+    Computes the final value of `agg_func` from the partial states of `value_column`.
+    
+    Arguments:
+        df_partial: The partial states, as returned by `partial_aggregate` or `merge_partials`.
+        value_column: The column whose values were aggregated.
+        agg_func: One of `MERGEABLE_AGG_FUNCS`.
+    Returns:
+        A pandas DataFrame containing the grouping columns and `value_column`.
+    """
+    columns = _partial_columns(value_column)
+    if agg_func not in MERGEABLE_AGG_FUNCS:
+        raise AttributeError(f'`{agg_func}` cannot be computed from partial states.')
+    total, count = df_partial[columns['sum']], df_partial[columns['count']]
+    # Groups without any value have no mean, like in pandas.
+    non_empty_count = count.where(count > 0)
+    variance = (df_partial[columns['sumsq']] - total.astype('float64') ** 2 / non_empty_count) / (non_empty_count - 1)
+    final_values = {
+        'sum': lambda: total,
+        'count': lambda: count,
+        'mean': lambda: total / non_empty_count,
+        'min': lambda: df_partial[columns['min']],
+        'max': lambda: df_partial[columns['max']],
+        'var': lambda: variance.clip(lower=0),
+        'std': lambda: np.sqrt(variance.clip(lower=0)),
+    }[agg_func]()
+    df_final = df_partial.drop(columns=list(columns.values()))
+    df_final[value_column] = final_values
+    return df_final
+
+
+def prune_nodes(
+        df: pd.DataFrame,
+        value_column: str,
+        label_column: str,
+        top_k: int=None,
+        min_share: float=0.0,
+        min_value: float=None,
+        group_column: str=None,
+        other_label: str='Other',
+        fold_funcs: dict=None
+    ) -> pd.DataFrame:
+    """
+    Keep only the largest rows of `df` by `value_column`, and fold the rest into a single `other_label` row.
+    
+    Arguments:
+        df: The aggregated dataframe to be pruned.
+        value_column: The column containing the values the rows are ranked by.
+        label_column: The column containing the labels of the rows, for example `Country`.
+        top_k: The maximum number of rows to keep in each group. `None` keeps every row.
+        min_share: The minimum share of the group total that a row must have to be kept.
+        min_value: The minimum value that a row must have to be kept.
+        group_column: If supplied, the pruning is done separately for each value of this column, for example
+            `Continent`.
+        other_label: The label of the row containing the folded rows.
+        fold_funcs: The functions which fold the columns of the removed rows into the `other_label` row, with the
+            column as the key. By default, `value_column` is summed, which is only correct for additive measures.
+            The partial states of `partial_aggregate` can be folded with `partial_fold_funcs`.
+    Returns:
+        A pandas DataFrame with at most `top_k + 1` rows per group.
+    """
+    if fold_funcs is None:
+        fold_funcs = {value_column: 'sum'}
+    groups = [(None, df)] if group_column is None else df.groupby(group_column, sort=False)
+    pruned = []
+    for group, df_group in groups:
+        values = df_group[value_column].to_numpy(dtype=float, na_value=0)
+        keep = values >= min_share * values.sum()
+        if min_value is not None:
+            keep &= values >= min_value
+        candidates = np.flatnonzero(keep)
+        # Partial sort, since only the largest `top_k` rows are needed and not their order.
+        if top_k is not None and len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-values[candidates], top_k - 1)[:top_k]]
+        kept = np.zeros(len(values), dtype=bool)
+        kept[candidates] = True
+        pruned.append(df_group[kept])
+        if not kept.all():
+            other = {column: df_group.loc[~kept, column].agg(func) for column, func in fold_funcs.items()}
+            other[label_column] = other_label
+            if group_column is not None:
+                other[group_column] = group
+            pruned.append(pd.DataFrame([other]))
+    if not pruned:
+        return df
+    df_pruned = pd.concat(pruned, ignore_index=True)
+    # The folded values may not fit in the original (for example, Int16) type.
+    for column in fold_funcs:
+        if pd.api.types.is_integer_dtype(df[column]):
+            df_pruned[column] = df_pruned[column].astype('int64')
+    return df_pruned